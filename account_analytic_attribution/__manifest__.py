@@ -35,7 +35,7 @@
     'author': 'Compassion CH',
     'website': 'http://www.compassion.ch',
     'category': 'Accounting',
-    'depends': ['analytic', 'account_fiscal_month'],
+    'depends': ['analytic', 'account_fiscal_month', 'queue_job'],
     'external_dependencies': {},
     'data': [
         'security/ir.model.access.csv',
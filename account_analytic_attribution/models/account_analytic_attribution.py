@@ -10,9 +10,13 @@
 ##############################################################################
 from datetime import datetime
 
-from odoo.tools import relativedelta
+from odoo.tools import relativedelta, float_compare, float_is_zero
 
-from odoo import api, models, fields
+from odoo import api, models, fields, tools
+
+
+# Number of analytic lines inserted with one query
+INSERT_CHUNK_SIZE = 1000
 
 
 class AccountAttribution(models.Model):
@@ -48,29 +52,101 @@ class AccountAttribution(models.Model):
         next_fy.hour = 20
         return fields.Datetime.to_string(next_fy)
 
+    @api.model
+    def create(self, vals):
+        self.clear_caches()
+        return super(AccountAttribution, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        self.clear_caches()
+        return super(AccountAttribution, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self.clear_caches()
+        return super(AccountAttribution, self).unlink()
+
     @api.model
     def get_attribution(self, account_tag_ids, analytic_tag_ids, date):
         """ Find a valid distribution rule given some data. """
-        domain = [
-            '|', ('date_start', '<=', date), ('date_start', '=', False),
-            '|', ('date_stop', '>=', date), ('date_stop', '=', False)
-        ]
+        index = self._get_attribution_index()
         if account_tag_ids:
-            domain += ['|', ('account_tag_id', 'in', account_tag_ids),
-                       ('account_tag_id', '=', False)]
-
+            account_tags = set(account_tag_ids) | {False}
         if analytic_tag_ids:
-            domain += ['|', ('analytic_tag_id', 'in', analytic_tag_ids),
-                       ('analytic_tag_id', '=', False)]
+            analytic_tags = set(analytic_tag_ids) | {False}
+        best_rule = None
+        for tags, rules in index.iteritems():
+            if (account_tag_ids and tags[0] not in account_tags) or \
+                    (analytic_tag_ids and tags[1] not in analytic_tags):
+                continue
+            for rule in rules:
+                priority, rule_id, date_start, date_stop = rule
+                if (not date_start or date_start <= date) and \
+                        (not date_stop or date_stop >= date):
+                    if best_rule is None or rule < best_rule:
+                        best_rule = rule
+                    # Rules are sorted by priority
+                    break
+        return self.browse(best_rule and best_rule[1])
 
-        return self.search(domain, limit=1)
+    @api.model
+    @tools.ormcache()
+    def _get_attribution_index(self):
+        """ Loads all distribution rules, indexed by their tags.
+        The index is cleared when a rule is modified.
+        :return: dict {(account_tag_id, analytic_tag_id): rules} where rules
+                 is a tuple of (priority, id, date_start, date_stop)
+                 sorted by priority
+        """
+        # The ORM reads an empty sequence as 0, but "sequence desc" puts
+        # NULL values first.
+        self.env.cr.execute("""
+            SELECT id FROM account_analytic_attribution
+            WHERE sequence IS NULL
+        """)
+        no_sequence_ids = set(r[0] for r in self.env.cr.fetchall())
+        index = dict()
+        for rule in self.search_read([], [
+                'sequence', 'account_tag_id', 'analytic_tag_id',
+                'date_start', 'date_stop']):
+            tags = (rule['account_tag_id'] and rule['account_tag_id'][0],
+                    rule['analytic_tag_id'] and rule['analytic_tag_id'][0])
+            if rule['id'] in no_sequence_ids:
+                priority = (0, 0)
+            else:
+                priority = (1, -rule['sequence'])
+            index.setdefault(tags, list()).append((
+                priority, rule['id'], rule['date_start'], rule['date_stop']))
+        return {tags: tuple(sorted(rules))
+                for tags, rules in index.iteritems()}
 
     @api.model
-    def perform_distribution(self, date_start=None, date_stop=None):
+    @tools.ormcache()
+    def _get_distribution_index(self):
+        """ Loads the distribution lines of all rules.
+        The index is cleared when a distribution line is modified.
+        :return: dict {attribution_id: ((account_analytic_id, rate), ...)}
+        """
+        index = dict()
+        for line in self.env['account.analytic.distribution.line'].search_read(
+                [], ['attribution_id', 'account_analytic_id', 'rate'],
+                order='id'):
+            index.setdefault(line['attribution_id'][0], list()).append(
+                (line['account_analytic_id'][0], line['rate']))
+        return {rule_id: tuple(lines) for rule_id, lines in index.iteritems()}
+
+    @api.model
+    def perform_distribution(self, date_start=None, date_stop=None,
+                             incremental=False):
         """
         Perform the attribution of the analytic lines.
         The attribution is done for each general account.
         By default it takes the last fiscal year for the computation.
+        In incremental mode, only the account pairs for which the total or
+        the attribution rule changed since the last attribution of the
+        same period are updated.
+        :return: attribution lines of the period
         """
         if not date_start or not date_stop:
             # Select the last year period
@@ -81,60 +157,203 @@ class AccountAttribution(models.Model):
             date_stop = fields.Date.to_string(fy['date_to'])
 
         analytic_line_obj = self.env['account.analytic.line']
+        snapshot_obj = self.env['account.analytic.attribution.snapshot']
         tag_id = self.env.ref(
             'account_analytic_attribution.tag_attribution').id
 
+        # Get the total amount to attribute for each pair of accounts
+        #   ->   {(analytic_id, general_account_id): total}
+        totals = dict()
+        for analytic_id, attribution in self._get_attribution_amounts(
+                date_start, date_stop, tag_id).iteritems():
+            for account_id, amount_total in attribution.iteritems():
+                totals[analytic_id, account_id] = amount_total
+
+        if incremental:
+            snapshots = snapshot_obj.search([
+                ('date_start', '=', date_start),
+                ('date_stop', '=', date_stop)])
+            if snapshots:
+                return self._update_distribution(
+                    date_start, date_stop, totals, tag_id, snapshots)
+
         # Remove old attributions for avoiding duplicates
         old_lines = analytic_line_obj.search([
             ('tag_ids', '=', tag_id),
             ('date', '>=', date_start),
             ('date', '<=', date_stop)])
         old_lines.unlink()
+        snapshot_obj.search([
+            ('date_stop', '>=', date_start),
+            ('date_stop', '<=', date_stop)]).unlink()
 
-        # Perform the attribution for each analytic line
-        analytic_lines = analytic_line_obj.search([
-            ('date', '>=', date_start),
-            ('date', '<=', date_stop),
-        ])
-        generated_lines = analytic_line_obj
+        return self._distribute(date_start, date_stop, totals, tag_id)
 
-        # Get the total amount to attribute for each analytic account
-        #   ->   {analytic_id: {general_account_id: total}}
-        attribution_amounts = dict()
-        for line in analytic_lines:
-            analytic_id = line.account_id.id
-            account_id = line.general_account_id.id
-            analytic_attribution = attribution_amounts.get(analytic_id, {
-                account_id: 0.0})
-            total = analytic_attribution.get(account_id, 0.0) + line.amount
-            analytic_attribution[account_id] = total
-            attribution_amounts[analytic_id] = analytic_attribution
-
-        # Attribute the amounts
+    @api.model
+    def _distribute(self, date_start, date_stop, totals, tag_id):
+        """ Attributes the totals of the given account pairs and keeps a
+        snapshot of each attributed pair.
+        :param totals: dict {(analytic_id, general_account_id): total}
+        :param tag_id: id of the analytic tag of attribution lines
+        :return: account.analytic.line recordset
+        """
         analytic_obj = self.env['account.analytic.account']
-        account_obj = self.env['account.account']
-        for analytic_id, attribution in attribution_amounts.iteritems():
-            for account_id, amount_total in attribution.iteritems():
-                account = account_obj.browse(account_id)
-                account_tag_ids = account.tag_ids.ids
-                analytic = analytic_obj.browse(analytic_id)
-                analytic_tag_ids = analytic.tag_ids.ids
-                attribution_rule = self.get_attribution(
-                    account_tag_ids, analytic_tag_ids, date_stop)
-                if attribution_rule:
-                    prefix = (analytic.code and
-                              analytic.code + '-') or ''
-                    for rule in attribution_rule.account_distribution_line_ids:
-                        line = analytic_line_obj.create({
-                            'name': 'Analytic attribution for ' +
-                                    analytic.name,
-                            'account_id': rule.account_analytic_id.id,
-                            'date': date_stop,
-                            'tag_ids': [(6, 0, [tag_id])],
-                            'amount': amount_total * (rule.rate / 100),
-                            'general_account_id': account_id,
-                            'ref': prefix + analytic.name,
-                        })
-                        generated_lines += line
-
-        return generated_lines
+        lines_vals = list()
+        snapshots_vals = list()
+        for (analytic_id, account_id), amount_total in totals.iteritems():
+            analytic = analytic_obj.browse(analytic_id)
+            attribution_rule, distribution = self._get_pair_attribution(
+                analytic_id, account_id, date_stop)
+            prefix = (analytic.code and analytic.code + '-') or ''
+            for account_analytic_id, rate in distribution:
+                lines_vals.append({
+                    'name': 'Analytic attribution for ' + analytic.name,
+                    'account_id': account_analytic_id,
+                    'date': date_stop,
+                    'amount': amount_total * (rate / 100),
+                    'general_account_id': account_id,
+                    'ref': prefix + analytic.name,
+                })
+            snapshots_vals.append({
+                'date_start': date_start,
+                'date_stop': date_stop,
+                'account_analytic_id': analytic_id,
+                'general_account_id': account_id,
+                'amount_total': amount_total,
+                'attribution_id': attribution_rule.id,
+                'distribution': repr(distribution),
+                'nb_lines': len(distribution),
+            })
+
+        lines = self._insert_attribution_lines(lines_vals, tag_id)
+        self.env['account.analytic.attribution.snapshot']._insert_snapshots(
+            snapshots_vals, lines.ids)
+        return lines
+
+    @api.model
+    def _update_distribution(self, date_start, date_stop, totals, tag_id,
+                             snapshots):
+        """ Updates the attribution of a period from the snapshots of its
+        last attribution. Pairs whose total changed are scaled in place,
+        pairs whose rule changed are attributed again and pairs that
+        disappeared are removed.
+        :param totals: dict {(analytic_id, general_account_id): total}
+        :param tag_id: id of the analytic tag of attribution lines
+        :param snapshots: account.analytic.attribution.snapshot recordset
+        :return: attribution lines of the period
+        """
+        snapshot_by_pair = {
+            (s.account_analytic_id.id, s.general_account_id.id): s
+            for s in snapshots
+        }
+        obsolete_ids = [
+            s.id for pair, s in snapshot_by_pair.iteritems()
+            if pair not in totals
+        ]
+        to_scale = list()
+        to_distribute = dict()
+        for pair, amount_total in totals.iteritems():
+            snapshot = snapshot_by_pair.get(pair)
+            attribution_rule, distribution = self._get_pair_attribution(
+                pair[0], pair[1], date_stop)
+            if snapshot and snapshot.attribution_id == attribution_rule \
+                    and snapshot.distribution == repr(distribution):
+                if not float_compare(snapshot.amount_total, amount_total,
+                                     precision_digits=2):
+                    continue
+                if not float_is_zero(snapshot.amount_total,
+                                     precision_digits=2):
+                    to_scale.append((snapshot, amount_total))
+                    continue
+            if snapshot:
+                obsolete_ids.append(snapshot.id)
+            to_distribute[pair] = amount_total
+
+        obsolete = snapshots.browse(obsolete_ids)
+        obsolete.mapped('analytic_line_ids').unlink()
+        obsolete.unlink()
+        for snapshot, amount_total in to_scale:
+            snapshot._scale(amount_total)
+        self._distribute(date_start, date_stop, to_distribute, tag_id)
+        self.env['account.analytic.line'].invalidate_cache(['amount'])
+
+        return snapshots.search([
+            ('date_start', '=', date_start),
+            ('date_stop', '=', date_stop)]).mapped('analytic_line_ids')
+
+    @api.model
+    def _get_pair_attribution(self, analytic_id, account_id, date):
+        """ Finds the attribution rule of a pair of accounts.
+        :return: tuple (account.analytic.attribution record, distribution)
+                 where distribution is a tuple of (account_analytic_id, rate)
+        """
+        account = self.env['account.account'].browse(account_id)
+        analytic = self.env['account.analytic.account'].browse(analytic_id)
+        attribution_rule = self.get_attribution(
+            account.tag_ids.ids, analytic.tag_ids.ids, date)
+        distribution = self._get_distribution_index().get(
+            attribution_rule.id, tuple())
+        return attribution_rule, distribution
+
+    @api.model
+    def _get_attribution_amounts(self, date_start, date_stop, tag_id):
+        """ Sums the analytic lines of the period by analytic account and
+        general account, leaving out the lines generated by attributions.
+        :param tag_id: id of the analytic tag of attribution lines
+        :return: dict {analytic_id: {general_account_id: total}}
+        """
+        self.env.cr.execute("""
+            SELECT l.account_id, l.general_account_id, sum(l.amount)
+            FROM account_analytic_line l
+            WHERE l.date >= %s AND l.date <= %s
+            AND NOT EXISTS (
+                SELECT 1 FROM account_analytic_line_tag_rel r
+                WHERE r.line_id = l.id AND r.tag_id = %s)
+            GROUP BY l.account_id, l.general_account_id
+        """, (date_start, date_stop, tag_id))
+        attribution_amounts = dict()
+        for analytic_id, account_id, total in self.env.cr.fetchall():
+            attribution_amounts.setdefault(analytic_id, dict())[
+                account_id or False] = total
+        return attribution_amounts
+
+    @api.model
+    def _insert_attribution_lines(self, lines_vals, tag_id):
+        """ Inserts the analytic lines by chunks with multi-row INSERT
+        queries, together with their attribution tag.
+        :param lines_vals: list of dict with keys name, account_id, date,
+                           amount, general_account_id and ref
+        :param tag_id: id of the analytic tag of attribution lines
+        :return: account.analytic.line recordset
+        """
+        analytic_ids = list(set(v['account_id'] for v in lines_vals))
+        companies = {
+            a['id']: a['company_id'][0] if a['company_id'] else None
+            for a in self.env['account.analytic.account'].browse(
+                analytic_ids).read(['company_id'])
+        }
+        uid = self.env.uid
+        now = fields.Datetime.now()
+        line_ids = list()
+        for index in range(0, len(lines_vals), INSERT_CHUNK_SIZE):
+            rows = [
+                (v['name'], v['account_id'], v['date'], v['amount'],
+                 v['general_account_id'] or None, v['ref'],
+                 companies[v['account_id']], 0.0, uid, uid, now, uid, now)
+                for v in lines_vals[index:index + INSERT_CHUNK_SIZE]
+            ]
+            self.env.cr.execute("""
+                INSERT INTO account_analytic_line (
+                    name, account_id, date, amount, general_account_id, ref,
+                    company_id, unit_amount, user_id,
+                    create_uid, create_date, write_uid, write_date)
+                VALUES {0}
+                RETURNING id
+            """.format(', '.join(['%s'] * len(rows))), rows)
+            chunk_ids = [r[0] for r in self.env.cr.fetchall()]
+            self.env.cr.execute("""
+                INSERT INTO account_analytic_line_tag_rel (line_id, tag_id)
+                SELECT unnest(%s), %s
+            """, (chunk_ids, tag_id))
+            line_ids.extend(chunk_ids)
+        return self.env['account.analytic.line'].browse(line_ids)
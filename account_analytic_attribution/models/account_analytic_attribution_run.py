@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2018 Compassion CH (http://www.compassion.ch)
+#    Releasing children from poverty in Jesus' name
+#    @author: Emanuel Cino <ecino@compassion.ch>
+#
+#    The licence is in the file __manifest__.py
+#
+##############################################################################
+from odoo import api, models, fields, _
+
+from odoo.addons.queue_job.job import job
+
+
+class AttributionRun(models.Model):
+    """
+    Gathers the attributions of several periods launched together, each
+    period being attributed by a separate job.
+    """
+    _name = "account.analytic.attribution.run"
+    _description = "Analytic Attribution Run"
+    _order = "create_date desc"
+
+    date_range_ids = fields.Many2many(
+        'date.range', 'analytic_attribution_run_date_range_rel',
+        'run_id', 'date_range_id', 'Periods', readonly=True
+    )
+    incremental = fields.Boolean(readonly=True)
+    # Filled by the jobs without writing the run, so that parallel jobs
+    # don't conflict on its row.
+    done_date_range_ids = fields.Many2many(
+        'date.range', 'analytic_attribution_run_done_date_range_rel',
+        'run_id', 'date_range_id', 'Attributed periods', readonly=True
+    )
+    analytic_line_ids = fields.Many2many(
+        'account.analytic.line', 'analytic_attribution_run_line_rel',
+        'run_id', 'line_id', 'Generated Analytic Lines', readonly=True
+    )
+    progress = fields.Float(compute='_compute_progress')
+
+    @api.multi
+    def _compute_progress(self):
+        for run in self:
+            if run.date_range_ids:
+                run.progress = 100.0 * len(run.done_date_range_ids) / len(
+                    run.date_range_ids)
+
+    @api.multi
+    def launch(self):
+        """ By default, launch one asynchronous job per period.
+            Context value async_mode set to False can force to perform
+            the task immediately.
+        """
+        for run in self:
+            for date_range in run.date_range_ids:
+                if self.env.context.get('async_mode', True):
+                    run.with_delay()._perform_period_distribution(date_range)
+                else:
+                    run._perform_period_distribution(date_range)
+        return True
+
+    @api.multi
+    def show_lines(self):
+        return {
+            'name': _('Generated Analytic Lines'),
+            'view_mode': 'tree,form',
+            'view_type': 'form',
+            'res_model': 'account.analytic.line',
+            'domain': [('id', 'in', self.mapped('analytic_line_ids').ids)],
+            'context': {'group_by': ['ref']},
+            'type': 'ir.actions.act_window',
+        }
+
+    @api.multi
+    @job(default_channel='root.analytic_attribution')
+    def _perform_period_distribution(self, date_range):
+        """ Attributes the analytic lines of one period and records the
+        generated lines on the run. """
+        self.ensure_one()
+        lines = self.env['account.analytic.attribution'].perform_distribution(
+            date_range.date_start, date_range.date_end, self.incremental)
+        self.env.cr.execute("""
+            INSERT INTO analytic_attribution_run_line_rel (run_id, line_id)
+            SELECT %s, unnest(%s::int[])
+        """, (self.id, lines.ids))
+        self.env.cr.execute("""
+            INSERT INTO analytic_attribution_run_done_date_range_rel (
+                run_id, date_range_id)
+            VALUES (%s, %s)
+        """, (self.id, date_range.id))
+        self.invalidate_cache(
+            ['analytic_line_ids', 'done_date_range_ids'], self.ids)
+        return True
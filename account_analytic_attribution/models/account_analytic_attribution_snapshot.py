@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2018 Compassion CH (http://www.compassion.ch)
+#    Releasing children from poverty in Jesus' name
+#    @author: Emanuel Cino <ecino@compassion.ch>
+#
+#    The licence is in the file __manifest__.py
+#
+##############################################################################
+from odoo import api, models, fields
+
+
+class AttributionSnapshot(models.Model):
+    """
+    Keeps the attributed total of a pair of analytic and general accounts
+    for a period, so that the attribution can be updated incrementally.
+    """
+    _name = "account.analytic.attribution.snapshot"
+    _description = "Analytic Attribution Snapshot"
+
+    date_start = fields.Date(required=True, index=True)
+    date_stop = fields.Date(required=True, index=True)
+    account_analytic_id = fields.Many2one(
+        'account.analytic.account', 'Analytic Account', required=True,
+        ondelete='cascade'
+    )
+    general_account_id = fields.Many2one(
+        'account.account', 'Financial Account', ondelete='cascade'
+    )
+    amount_total = fields.Float()
+    attribution_id = fields.Many2one(
+        'account.analytic.attribution', 'Analytic Attribution',
+        ondelete='set null'
+    )
+    distribution = fields.Char(
+        help='Distribution lines of the rule used for the attribution'
+    )
+    analytic_line_ids = fields.Many2many(
+        'account.analytic.line', 'account_analytic_attribution_snapshot_rel',
+        'snapshot_id', 'line_id', 'Attribution lines'
+    )
+
+    @api.model
+    def _insert_snapshots(self, snapshots_vals, line_ids):
+        """ Inserts the snapshots with one query and links them to their
+        attribution lines.
+        :param snapshots_vals: list of dict with the snapshot values and
+                               the number of lines generated for the pair
+                               in key nb_lines
+        :param line_ids: ids of the attribution lines, in the order of the
+                         snapshots
+        :return: account.analytic.attribution.snapshot recordset
+        """
+        if not snapshots_vals:
+            return self
+        uid = self.env.uid
+        now = fields.Datetime.now()
+        rows = [
+            (v['date_start'], v['date_stop'], v['account_analytic_id'],
+             v['general_account_id'] or None, v['amount_total'],
+             v['attribution_id'] or None, v['distribution'],
+             uid, now, uid, now)
+            for v in snapshots_vals
+        ]
+        self.env.cr.execute("""
+            INSERT INTO account_analytic_attribution_snapshot (
+                date_start, date_stop, account_analytic_id,
+                general_account_id, amount_total, attribution_id,
+                distribution, create_uid, create_date, write_uid, write_date)
+            VALUES {0}
+            RETURNING id
+        """.format(', '.join(['%s'] * len(rows))), rows)
+        snapshot_ids = [r[0] for r in self.env.cr.fetchall()]
+
+        rel_snapshot_ids = list()
+        for snapshot_id, vals in zip(snapshot_ids, snapshots_vals):
+            rel_snapshot_ids.extend([snapshot_id] * vals['nb_lines'])
+        self.env.cr.execute("""
+            INSERT INTO account_analytic_attribution_snapshot_rel (
+                snapshot_id, line_id)
+            SELECT unnest(%s::int[]), unnest(%s::int[])
+        """, (rel_snapshot_ids, line_ids))
+        return self.browse(snapshot_ids)
+
+    @api.multi
+    def _scale(self, amount_total):
+        """ Updates in place the attribution lines of a snapshot for a new
+        total of its accounts. """
+        self.ensure_one()
+        self.env.cr.execute("""
+            UPDATE account_analytic_line SET amount = amount * %s
+            WHERE id = ANY(%s)
+        """, (amount_total / self.amount_total, self.analytic_line_ids.ids))
+        self.amount_total = amount_total
+        return True
@@ -8,7 +8,7 @@
 #    The licence is in the file __manifest__.py
 #
 ##############################################################################
-from odoo import models, fields
+from odoo import api, models, fields
 
 
 class AccountDistributionLine(models.Model):
@@ -23,3 +23,18 @@ class AccountDistributionLine(models.Model):
     account_analytic_id = fields.Many2one(
         'account.analytic.account', 'Analytic Account', required=True
     )
+
+    @api.model
+    def create(self, vals):
+        self.clear_caches()
+        return super(AccountDistributionLine, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        self.clear_caches()
+        return super(AccountDistributionLine, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self.clear_caches()
+        return super(AccountDistributionLine, self).unlink()
@@ -23,23 +23,28 @@ class AttributionWizard(models.TransientModel):
         domain=[('type_id.fiscal_month', '=', True)],
         help='Takes the current year if none is selected.'
     )
+    incremental = fields.Boolean(
+        help='Only update the attributions of accounts whose total or '
+             'attribution rule changed since the last attribution of the '
+             'same period.'
+    )
 
     @api.multi
     def perform_distribution(self):
-        """ Perform analytic attributions. """
+        """ Perform analytic attributions: each period is attributed by
+        a separate job and followed in an attribution run. """
         self.ensure_one()
-        lines = self.env['account.analytic.line']
-        for date_range in self.date_range_ids:
-            lines += self.env[
-                'account.analytic.attribution'].perform_distribution(
-                date_range.date_start, date_range.date_end)
+        run = self.env['account.analytic.attribution.run'].create({
+            'date_range_ids': [(6, 0, self.date_range_ids.ids)],
+            'incremental': self.incremental,
+        })
+        run.launch()
 
         return {
-            'name': _('Generated Analytic Lines'),
-            'view_mode': 'tree,form',
+            'name': _('Analytic Attribution'),
+            'view_mode': 'form',
             'view_type': 'form',
-            'res_model': 'account.analytic.line',
-            'domain': [('id', 'in', lines.ids)],
-            'context': {'group_by': ['ref']},
+            'res_model': 'account.analytic.attribution.run',
+            'res_id': run.id,
             'type': 'ir.actions.act_window',
         }
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2018 Compassion CH (http://www.compassion.ch)
+#    Releasing children from poverty in Jesus' name
+#    @author: Emanuel Cino <ecino@compassion.ch>
+#
+#    The licence is in the file __manifest__.py
+#
+##############################################################################
+
+from odoo import api, models
+
+
+class AccountJournal(models.Model):
+    """ Clears the cached accounting defaults when journals change. """
+    _inherit = 'account.journal'
+
+    @api.model
+    def create(self, vals):
+        self.env['res.company'].clear_caches()
+        return super(AccountJournal, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        self.env['res.company'].clear_caches()
+        return super(AccountJournal, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self.env['res.company'].clear_caches()
+        return super(AccountJournal, self).unlink()
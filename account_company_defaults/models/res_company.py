@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2018 Compassion CH (http://www.compassion.ch)
+#    Releasing children from poverty in Jesus' name
+#    @author: Emanuel Cino <ecino@compassion.ch>
+#
+#    The licence is in the file __manifest__.py
+#
+##############################################################################
+
+from odoo import api, models, tools
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    @api.model
+    @tools.ormcache('company_id')
+    def _get_accounting_defaults(self, company_id):
+        """ Returns the accounting defaults used to create customer invoices
+        in the given company. The result is cached and shared: don't modify
+        it.
+        :param company_id: res.company id
+        :return: dict {
+            'sale_journal_id': first sale journal of the company,
+            'payment_term_id': immediate payment term
+        }
+        """
+        payment_term = self.env.ref(
+            'account.account_payment_term_immediate', False)
+        return {
+            'sale_journal_id': self.env['account.journal'].search([
+                ('type', '=', 'sale'), ('company_id', '=', company_id)
+            ], limit=1).id,
+            'payment_term_id': payment_term.id if payment_term else False,
+        }
@@ -9,4 +9,5 @@
 #
 ##############################################################################
 
+from . import models
 from . import wizards
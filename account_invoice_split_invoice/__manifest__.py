@@ -35,7 +35,7 @@
     'author': 'Compassion CH',
     'website': 'http://www.compassion.ch',
     'category': 'Accounting',
-    'depends': ['account', 'account_cancel'],
+    'depends': ['account', 'account_cancel', 'queue_job'],
     'external_dependencies': {},
     'data': [
         'views/account_invoice_split_wizard_view.xml',
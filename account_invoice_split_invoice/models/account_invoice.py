@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2018 Compassion CH (http://www.compassion.ch)
+#    Releasing children from poverty in Jesus' name
+#    @author: Emanuel Cino <ecino@compassion.ch>
+#
+#    The licence is in the file __manifest__.py
+#
+##############################################################################
+import logging
+from collections import OrderedDict
+
+from odoo import api, models, _
+from odoo.exceptions import UserError
+
+from odoo.addons.queue_job.job import job
+
+logger = logging.getLogger(__name__)
+
+# Number of invoices split by one job
+SPLIT_CHUNK_SIZE = 200
+
+
+class AccountInvoice(models.Model):
+    """ Split many invoices at once. """
+    _inherit = 'account.invoice'
+
+    ##########################################################################
+    #                             PUBLIC METHODS                             #
+    ##########################################################################
+    @api.multi
+    def split_invoices_by(self, criterion, chunk_size=SPLIT_CHUNK_SIZE):
+        """ Split the invoices with jobs of chunk_size invoices.
+            Context value async_mode set to False can force to perform
+            the task immediately.
+        :param criterion: 'contract' or 'product'
+        :return: True
+        """
+        for index in range(0, len(self), chunk_size):
+            chunk = self[index:index + chunk_size]
+            if self.env.context.get('async_mode', True):
+                chunk.with_delay()._split_invoices_by(criterion)
+            else:
+                chunk._split_invoices_by(criterion)
+        return True
+
+    @api.model
+    def split_invoice_lines(self, line_sets):
+        """ Move each set of invoice lines onto a new invoice having the
+        same header than the invoice of the lines. Invoices which were
+        open are validated again, together with their new invoices.
+        :param line_sets: list of account.invoice.line recordsets, the lines
+                          of a set belonging to the same invoice
+        :return: account.invoice recordset of the new invoices
+        """
+        invoice_obj = self.env['account.invoice']
+        line_sets = [
+            lines for lines in line_sets
+            if lines and lines[0].invoice_id.state in ('draft', 'open')
+        ]
+        old_invoices = invoice_obj
+        for lines in line_sets:
+            old_invoices |= lines[0].invoice_id
+        if not old_invoices:
+            return invoice_obj
+
+        to_open = old_invoices.filtered(lambda i: i.state == 'open')
+        if to_open:
+            to_open.action_invoice_cancel()
+            to_open.action_invoice_draft()
+            self.env.invalidate_all()
+
+        new_invoices = invoice_obj
+        recompute_obj = self.env['account.invoice.line'].with_context(
+            recompute=False)
+        for lines in line_sets:
+            old_invoice = lines[0].invoice_id
+            new_invoice = old_invoice._copy_header()
+            recompute_obj.browse(lines.ids).write(
+                {'invoice_id': new_invoice.id})
+            new_invoices |= new_invoice
+            if old_invoice in to_open:
+                to_open |= new_invoice
+        self.recompute()
+        (old_invoices | new_invoices).compute_taxes()
+
+        if to_open:
+            to_open.action_invoice_open()
+        return new_invoices
+
+    ##########################################################################
+    #                             PRIVATE METHODS                            #
+    ##########################################################################
+    @api.multi
+    @job(default_channel='root.account_invoice_split')
+    def _split_invoices_by(self, criterion):
+        """ Split the invoices so that each one keeps the lines of a single
+        contract or product. The lines of the first contract or product
+        stay in the invoice, the others are moved onto new invoices.
+        :param criterion: 'contract' or 'product'
+        :return: account.invoice recordset of the new invoices
+        """
+        logger.info("Splitting %s invoices by %s", len(self), criterion)
+        line_sets = list()
+        for invoice in self:
+            line_sets.extend(
+                invoice._get_split_line_sets(criterion).values()[1:])
+        new_invoices = self.split_invoice_lines(line_sets)
+        logger.info("%s invoices created", len(new_invoices))
+        return new_invoices
+
+    @api.multi
+    def _get_split_line_sets(self, criterion):
+        """ Group the lines of the invoice by the split criterion.
+        :return: OrderedDict {criterion record: account.invoice.line}
+        """
+        self.ensure_one()
+        field = {
+            'contract': 'contract_id',
+            'product': 'product_id',
+        }.get(criterion)
+        if field not in self.env['account.invoice.line']._fields:
+            raise UserError(_("Invoices cannot be split by %s.") % criterion)
+        line_sets = OrderedDict()
+        for line in self.invoice_line_ids:
+            key = line[field]
+            line_sets[key] = line_sets.get(key, line.browse()) | line
+        return line_sets
+
+    @api.multi
+    def _copy_header(self):
+        """ Create a new draft invoice with the same header, without any
+        line. """
+        self.ensure_one()
+        return self.copy(default={
+            'date_invoice': self.date_invoice,
+            'invoice_line_ids': [],
+            'tax_line_ids': [],
+        })
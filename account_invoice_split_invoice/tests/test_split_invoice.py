@@ -131,6 +131,40 @@ class TestSplitInvoice(common.TransactionCase):
             invoice_new.amount_total + invoice.amount_total
         )
 
+    def test_split_many_invoices(self):
+        """ Split an open and a draft invoice at once """
+        invoice_obj = self.env['account.invoice']
+        invl_obj = self.env['account.invoice.line']
+        invoice = invoice_obj.browse(self.invoice_id)
+        invoice1 = invoice_obj.browse(self.invoice_id1)
+        invoice.action_invoice_open()
+        original_amount = invoice.amount_total
+        original_amount1 = invoice1.amount_total
+
+        new_invoices = invoice_obj.split_invoice_lines([
+            invl_obj.browse(self.invoice_line_id2),
+            invl_obj.browse(self.invoice_line_id22),
+        ])
+        self.assertEqual(len(new_invoices), 2)
+        new_invoice = new_invoices.filtered(
+            lambda i: i.partner_id == invoice.partner_id)
+        new_invoice1 = new_invoices - new_invoice
+        self.assertEqual(invoice.state, 'open')
+        self.assertEqual(new_invoice.state, 'open')
+        self.assertEqual(invoice1.state, 'draft')
+        self.assertEqual(new_invoice1.state, 'draft')
+        self.assertEqual(new_invoice.invoice_line_ids.ids,
+                         [self.invoice_line_id2])
+        self.assertEqual(new_invoice1.invoice_line_ids.ids,
+                         [self.invoice_line_id22])
+        self.assertEqual(new_invoice.date_invoice, invoice.date_invoice)
+        self.assertEqual(
+            original_amount,
+            new_invoice.amount_total + invoice.amount_total)
+        self.assertEqual(
+            original_amount1,
+            new_invoice1.amount_total + invoice1.amount_total)
+
     def _create_invoice(self, invoice_name):
         """ Set the update_posted to True to make invoice cancelable """
         journal_obj = self.env['account.journal']
@@ -35,23 +35,6 @@ class SplitInvoiceWizard(models.TransientModel):
         invoice = False
 
         if self.invoice_line_ids:
-            old_invoice = self.invoice_line_ids[0].invoice_id
-            if old_invoice.state in ('draft', 'open'):
-                invoice = self._copy_invoice(old_invoice)
-                was_open = old_invoice.state == 'open'
-                if was_open:
-                    old_invoice.action_invoice_cancel()
-                    old_invoice.action_invoice_draft()
-                    old_invoice.env.invalidate_all()
-                self.invoice_line_ids.write({'invoice_id': invoice.id})
-                if was_open:
-                    old_invoice.action_invoice_open()
-                    invoice.action_invoice_open()
+            invoice = self.env['account.invoice'].split_invoice_lines(
+                [self.invoice_line_ids]) or False
         return invoice
-
-    def _copy_invoice(self, old_invoice):
-        # Create new invoice
-        new_invoice = old_invoice.copy(
-            default={'date_invoice': old_invoice.date_invoice})
-        new_invoice.invoice_line_ids.unlink()
-        return new_invoice
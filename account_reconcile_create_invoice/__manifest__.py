@@ -30,14 +30,15 @@
 # pylint: disable=C8101
 {
     'name': 'Create invoices from bank statement reconciliation',
-    'version': '10.0.1.0.0',
+    'version': '10.0.1.1.0',
     'author': 'Compassion CH',
     'license': 'AGPL-3',
     'category': 'Finance',
     'website': 'http://www.compassion.ch',
     'depends': [
         'account',
-        'analytic'
+        'analytic',
+        'account_company_defaults',
     ],
     'data': [
         'views/statement_view.xml',
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2018 Compassion CH (http://www.compassion.ch)
+#    Releasing children from poverty in Jesus' name
+#    @author: Emanuel Cino <ecino@compassion.ch>
+#
+#    The licence is in the file __manifest__.py
+#
+##############################################################################
+
+
+def migrate(cr, version):
+    if not version:
+        return
+
+    # Link the invoices already generated to their bank statement
+    cr.execute("""
+UPDATE account_invoice i SET bank_statement_id = (
+    SELECT min(s.id) FROM account_bank_statement s WHERE s.name = i.origin
+)
+WHERE i.bank_statement_id IS NULL
+AND i.origin IN (SELECT name FROM account_bank_statement)
+    """)
@@ -9,6 +9,8 @@
 #
 ##############################################################################
 
+from . import account_invoice
 from . import bank_statement
 from . import bank_statement_line
 from . import statement_operation
+from . import account_invoice_line
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2018 Compassion CH (http://www.compassion.ch)
+#    Releasing children from poverty in Jesus' name
+#    @author: Emanuel Cino <ecino@compassion.ch>
+#
+#    The licence is in the file __manifest__.py
+#
+##############################################################################
+
+from odoo import fields, models
+
+
+class AccountInvoice(models.Model):
+    """ Link invoices to the bank statement which generated them. """
+    _inherit = 'account.invoice'
+
+    bank_statement_id = fields.Many2one(
+        'account.bank.statement', 'Bank statement', index=True,
+        readonly=True, copy=False, ondelete='set null'
+    )
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (C) 2018 Compassion CH (http://www.compassion.ch)
+#    Releasing children from poverty in Jesus' name
+#    @author: Emanuel Cino <ecino@compassion.ch>
+#
+#    The licence is in the file __manifest__.py
+#
+##############################################################################
+from odoo import api, models
+
+
+class AccountInvoiceLine(models.Model):
+    _inherit = 'account.invoice.line'
+
+    @api.model_cr
+    def init(self):
+        """ Index used to find open invoices matching statement lines. """
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS
+            account_invoice_line_partner_product_subtotal_index
+            ON account_invoice_line (partner_id, product_id, price_subtotal)
+        """)
@@ -21,8 +21,8 @@ class AccountStatement(models.Model):
     #                                 FIELDS                                 #
     ##########################################################################
 
-    invoice_ids = fields.Many2many(
-        'account.invoice', string='Invoices', compute='_compute_invoices'
+    invoice_ids = fields.One2many(
+        'account.invoice', 'bank_statement_id', 'Invoices', readonly=True
     )
     generated_invoices_count = fields.Integer(
         'Invoices', compute='_compute_invoices')
@@ -32,11 +32,15 @@ class AccountStatement(models.Model):
     ##########################################################################
     @api.multi
     def _compute_invoices(self):
-        invoice_obj = self.env['account.invoice']
+        invoice_data = self.env['account.invoice'].read_group(
+            [('bank_statement_id', 'in', self.ids)], ['bank_statement_id'],
+            ['bank_statement_id'])
+        counts = {
+            data['bank_statement_id'][0]: data['bank_statement_id_count']
+            for data in invoice_data
+        }
         for stmt in self:
-            invoices = invoice_obj.search([('origin', '=', stmt.name)])
-            stmt.invoice_ids = invoices
-            stmt.generated_invoices_count = len(invoices)
+            stmt.generated_invoices_count = counts.get(stmt.id, 0)
 
     ##########################################################################
     #                             PUBLIC METHODS                             #
@@ -50,7 +54,7 @@ class AccountStatement(models.Model):
             'view_mode': 'tree,form',
             'view_type': 'form',
             'res_model': 'account.invoice',
-            'domain': [('origin', '=', self.name)],
+            'domain': [('bank_statement_id', '=', self.id)],
             'type': 'ir.actions.act_window',
             'target': 'current',
             'context': {'form_view_ref': 'account.invoice_form',
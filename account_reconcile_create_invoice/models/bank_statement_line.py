@@ -102,8 +102,155 @@ class BankStatementLine(models.Model):
         return super(BankStatementLine, self).process_reconciliation(
             counterpart_aml_dicts, payment_aml_rec, new_aml_dicts)
 
-    def _create_invoice_from_mv_lines(self, mv_line_dicts, invoice=None):
-        # Generate a unique bvr_reference
+    @api.model
+    def process_reconciliation_batch(self, reconciliation_data):
+        """ Reconcile many statement lines at once. The invoices needed by
+        the lines are created together and opened in one call, then each
+        line is reconciled inside its own savepoint so that one failure
+        does not abort the others.
+        :param reconciliation_data: list of tuples (statement line,
+                                    counterpart_aml_dicts, new_aml_dicts)
+        :return: account.move recordset of the counterpart moves
+        """
+        moves = self.env['account.move']
+        to_invoice = list()
+        open_invoices = self._find_open_invoices_batch([
+            (line, [mv_line_dict for mv_line_dict in new_aml_dicts or list()
+                    if mv_line_dict.get('product_id')])
+            for line, counterpart_aml_dicts, new_aml_dicts in
+            reconciliation_data
+        ])
+        for (line, counterpart_aml_dicts, new_aml_dicts), invoices in zip(
+                reconciliation_data, open_invoices):
+            # The reconciliation modifies the move line data: work on copies
+            # so that the data given by the caller is left untouched.
+            counterpart_aml_dicts = [
+                dict(data) for data in counterpart_aml_dicts or list()]
+            new_aml_dicts = [dict(data) for data in new_aml_dicts or list()]
+            inv_mv_lines = [
+                mv_line_dict for mv_line_dict in new_aml_dicts
+                if mv_line_dict.get('product_id')
+            ]
+            invoiced = any(data['move_line'].filtered('invoice_id')
+                           for data in counterpart_aml_dicts)
+            if inv_mv_lines and not invoiced and not invoices:
+                to_invoice.append((line, counterpart_aml_dicts,
+                                   new_aml_dicts, inv_mv_lines))
+            else:
+                # Existing invoices are reused: keep the single line process,
+                # giving it the open invoices already found.
+                moves |= line.with_context(
+                    open_invoice_ids=invoices.ids
+                )._process_reconciliation_savepoint(
+                    counterpart_aml_dicts, new_aml_dicts)
+
+        # Create all invoices, then open them together
+        lines = reduce(lambda l1, l2: l1 | l2,
+                       [data[0] for data in to_invoice], self.browse())
+        # Read the receivable accounts of all partners at once
+        lines.mapped('partner_id.property_account_receivable_id')
+        invoiced_data = list()
+        for line, counterpart_aml_dicts, new_aml_dicts, inv_mv_lines in \
+                to_invoice:
+            try:
+                with self.env.cr.savepoint():
+                    ref = line._get_invoice_ref()
+                    invoice = line._create_invoice(ref, inv_mv_lines)
+                invoiced_data.append((line, counterpart_aml_dicts,
+                                      new_aml_dicts, inv_mv_lines,
+                                      invoice, ref))
+            except Exception:
+                logger.error("Invoice creation failed for statement line "
+                             "%s", line.id, exc_info=True)
+                self.env.invalidate_all()
+        invoices = self._open_invoices_batch(
+            reduce(lambda i1, i2: i1 + i2,
+                   [data[4] for data in invoiced_data],
+                   self.env['account.invoice']))
+
+        # Reconcile each line with the counterpart of its invoice
+        for line, counterpart_aml_dicts, new_aml_dicts, inv_mv_lines, \
+                invoice, ref in invoiced_data:
+            if invoice not in invoices:
+                # The draft invoice could not be validated: remove it so
+                # that it isn't left linked to the statement.
+                try:
+                    with self.env.cr.savepoint():
+                        invoice.unlink()
+                except Exception:
+                    logger.error("Invoice %s of statement line %s could not "
+                                 "be deleted", invoice.id, line.id,
+                                 exc_info=True)
+                    self.env.invalidate_all()
+                continue
+            new_counterpart = invoice.move_id.line_ids.filtered(
+                lambda ml: ml.debit > 0)
+            for data in inv_mv_lines:
+                new_aml_dicts.remove(data)
+                data['move_line'] = new_counterpart
+                counterpart_aml_dicts.append(data)
+            line.ref = ref
+            line_moves = line._process_reconciliation_savepoint(
+                counterpart_aml_dicts, new_aml_dicts)
+            if line_moves:
+                moves |= line_moves
+            else:
+                try:
+                    with self.env.cr.savepoint():
+                        invoice.action_invoice_cancel()
+                except Exception:
+                    logger.error("Invoice %s of statement line %s could not "
+                                 "be cancelled", invoice.id, line.id,
+                                 exc_info=True)
+                    self.env.invalidate_all()
+        return moves
+
+    @api.multi
+    def _process_reconciliation_savepoint(self, counterpart_aml_dicts,
+                                          new_aml_dicts):
+        """ Reconcile the line inside a savepoint.
+        :return: counterpart moves or empty recordset if it failed
+        """
+        self.ensure_one()
+        try:
+            with self.env.cr.savepoint():
+                return self.process_reconciliation(
+                    counterpart_aml_dicts=counterpart_aml_dicts,
+                    new_aml_dicts=new_aml_dicts)
+        except Exception:
+            logger.error("Reconciliation failed for statement line %s",
+                         self.id, exc_info=True)
+            self.env.invalidate_all()
+            return self.env['account.move']
+
+    @api.model
+    def _open_invoices_batch(self, invoices):
+        """ Validate the invoices in one call. If it fails, they are
+        validated one by one to isolate the faulty ones.
+        :return: account.invoice recordset of the opened invoices
+        """
+        if not invoices:
+            return invoices
+        try:
+            with self.env.cr.savepoint():
+                invoices.action_invoice_open()
+            return invoices
+        except Exception:
+            self.env.invalidate_all()
+        opened = self.env['account.invoice']
+        for invoice in invoices:
+            try:
+                with self.env.cr.savepoint():
+                    invoice.action_invoice_open()
+                opened |= invoice
+            except Exception:
+                logger.error("Validation failed for invoice %s",
+                             invoice.id, exc_info=True)
+                self.env.invalidate_all()
+        return opened
+
+    def _get_invoice_ref(self):
+        """ Generate a unique bvr reference for the invoice. """
         if self.ref and len(self.ref) == 27:
             ref = self.ref
         elif self.ref and len(self.ref) > 27:
@@ -111,20 +258,45 @@ class BankStatementLine(models.Model):
         else:
             ref = mod10r((self.date.replace('-', '') + str(
                 self.statement_id.id) + str(self.id)).ljust(26, '0'))
+        return ref
+
+    def _create_invoice(self, ref, mv_line_dicts):
+        """ Create a draft invoice with one line per move line data.
+        :return: account.invoice record
+        """
+        inv_data = self._get_invoice_data(ref, mv_line_dicts)
+        invoice = self.env['account.invoice'].create(inv_data)
+        for mv_line_dict in mv_line_dicts:
+            inv_line_data = self._get_invoice_line_data(mv_line_dict, invoice)
+            self.env['account.invoice.line'].create(inv_line_data)
+        return invoice
+
+    def _create_invoice_from_mv_lines(self, mv_line_dicts, invoice=None):
+        ref = self._get_invoice_ref()
 
         if invoice:
             invoice.action_invoice_cancel()
             invoice.action_invoice_draft()
             invoice.env.invalidate_all()
-            invoice.write({'origin': self.statement_id.name})
+            invoice.write({
+                'origin': self.statement_id.name,
+                'bank_statement_id': self.statement_id.id,
+            })
 
         else:
             # Lookup for an existing open invoice matching the criterias
-            invoices = self._find_open_invoice(mv_line_dicts)
+            if 'open_invoice_ids' in self.env.context:
+                invoices = self.env['account.invoice'].browse(
+                    self.env.context['open_invoice_ids'])
+            else:
+                invoices = self._find_open_invoice(mv_line_dicts)
             if invoices:
                 # Get the bvr reference of the invoice or set it
                 invoice = invoices[0]
-                invoice.write({'origin': self.statement_id.name})
+                invoice.write({
+                    'origin': self.statement_id.name,
+                    'bank_statement_id': self.statement_id.id,
+                })
                 if invoice.reference and not self.ref:
                     ref = invoice.reference
                 else:
@@ -157,17 +329,18 @@ class BankStatementLine(models.Model):
         :param mv_line_dicts: all data for reconciliation
         :return: dict of account.invoice vals
         """
-        journal_id = self.env['account.journal'].search(
-            [('type', '=', 'sale')], limit=1).id
+        defaults = self.env['res.company']._get_accounting_defaults(
+            self.company_id.id)
         return {
             'account_id':
                 self.partner_id.property_account_receivable_id.id,
             'type': 'out_invoice',
             'partner_id': self.partner_id.id,
-            'journal_id': journal_id,
+            'journal_id': defaults['sale_journal_id'],
             'date_invoice': self.date,
             'reference': ref,
             'origin': self.statement_id.name,
+            'bank_statement_id': self.statement_id.id,
             'comment': ';'.join(map(
                 lambda d: d.get('comment', ''),
                 mv_line_dicts)),
@@ -203,18 +376,59 @@ class BankStatementLine(models.Model):
     def _find_open_invoice(self, mv_line_dicts):
         """ Find an open invoice that matches the statement line and which
         could be reconciled with. """
-        invoice_line_obj = self.env['account.invoice.line']
-        inv_lines = invoice_line_obj
-        for mv_line_dict in mv_line_dicts:
-            amount = mv_line_dict['credit']
-            inv_lines |= invoice_line_obj.search([
-                ('partner_id', '=', mv_line_dict.get('partner_id')),
-                ('invoice_id.state', 'in', ('open', 'draft')),
-                ('product_id', '=', mv_line_dict.get('product_id')),
-                ('price_subtotal', '=', amount)])
-
-        return inv_lines.mapped('invoice_id').filtered(
-            lambda i: i.amount_total == self.amount)
+        return self._find_open_invoices_batch([(self, mv_line_dicts)])[0]
+
+    @api.model
+    def _find_open_invoices_batch(self, reconciliation_data):
+        """ Find with one query the open invoices matching many
+        reconciliations: invoices having a line with the same partner,
+        product and amount than a move line and a total equal to the
+        statement line amount.
+        :param reconciliation_data: list of tuples (statement line,
+                                    mv_line_dicts)
+        :return: list of account.invoice recordsets, in the order of the
+                 given reconciliations
+        """
+        positions = list()
+        dict_indexes = list()
+        partner_ids = list()
+        product_ids = list()
+        amounts = list()
+        totals = list()
+        for position, (line, mv_line_dicts) in enumerate(
+                reconciliation_data):
+            for dict_index, mv_line_dict in enumerate(mv_line_dicts):
+                positions.append(position)
+                dict_indexes.append(dict_index)
+                partner_ids.append(mv_line_dict.get('partner_id') or None)
+                product_ids.append(mv_line_dict.get('product_id') or None)
+                amounts.append(mv_line_dict['credit'])
+                totals.append(line.amount)
+        invoice_ids = [list() for data in reconciliation_data]
+        if positions:
+            self.env.cr.execute("""
+                SELECT c.position, l.invoice_id
+                FROM unnest(%s::int[], %s::int[], %s::int[], %s::int[],
+                            %s::numeric[], %s::numeric[])
+                    AS c(position, dict_index, partner_id, product_id,
+                         amount, total)
+                JOIN account_invoice_line l
+                    ON (l.partner_id = c.partner_id OR
+                        l.partner_id IS NULL AND c.partner_id IS NULL)
+                    AND l.product_id = c.product_id
+                    AND l.price_subtotal = c.amount
+                JOIN account_invoice i ON i.id = l.invoice_id
+                WHERE i.state IN ('open', 'draft')
+                AND i.amount_total = c.total
+                ORDER BY c.position, c.dict_index, l.invoice_id, l.sequence,
+                         l.id
+            """, (positions, dict_indexes, partner_ids, product_ids, amounts,
+                  totals))
+            for position, invoice_id in self.env.cr.fetchall():
+                if invoice_id not in invoice_ids[position]:
+                    invoice_ids[position].append(invoice_id)
+        invoice_obj = self.env['account.invoice']
+        return [invoice_obj.browse(ids) for ids in invoice_ids]
 
     def _reconcile(self, matching_records):
         # Now reconcile (code copied from L707)
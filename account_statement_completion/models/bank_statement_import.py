@@ -11,6 +11,9 @@
 
 from odoo import api, models
 
+# Number of transactions completed at once
+COMPLETION_CHUNK_SIZE = 1000
+
 
 class AccountStatementImport(models.TransientModel):
     _inherit = 'account.bank.statement.import'
@@ -23,11 +26,17 @@ class AccountStatementImport(models.TransientModel):
         stmts_vals = super(AccountStatementImport, self)._complete_stmts_vals(
             stmts_vals, journal, account_number)
         if journal.completion_rules:
+            chunk_size = int(self.env['ir.config_parameter'].sudo().get_param(
+                'account_statement_completion.chunk_size',
+                COMPLETION_CHUNK_SIZE))
             for st_vals in stmts_vals:
-                for line_vals in st_vals.get('transactions', list()):
-                    # Try to find more data using completion rules
-                    line_vals.update(
-                        journal.completion_rules.auto_complete(
-                            st_vals, line_vals)
-                    )
+                lines_vals = st_vals.get('transactions', list())
+                # Try to find more data using completion rules, by chunks of
+                # transactions to bound the memory used by the rules.
+                for index in range(0, len(lines_vals), chunk_size):
+                    chunk = lines_vals[index:index + chunk_size]
+                    results = journal.completion_rules.auto_complete_lines(
+                        st_vals, chunk)
+                    for line_vals, result in zip(chunk, results):
+                        line_vals.update(result)
         return stmts_vals
@@ -38,6 +38,25 @@ class StatementCompletionRule(models.Model):
         string='Related statement journal')
     function_to_call = fields.Selection('_get_functions', 'Method')
 
+    @api.model_cr
+    def init(self):
+        """ Index the references searched by the completion rules. """
+        indexes = [
+            ('account_move_line', 'account_move_line_ref_partner_index',
+             '(ref) WHERE partner_id IS NOT NULL'),
+            ('bank_payment_line', 'bank_payment_line_name_date_index',
+             '(name, date)'),
+        ]
+        for table, index, definition in indexes:
+            self.env.cr.execute("""
+                SELECT 1 FROM pg_class WHERE relname = %s AND relkind = 'r'
+            """, (table,))
+            if not self.env.cr.fetchone():
+                continue
+            self.env.cr.execute(
+                "CREATE INDEX IF NOT EXISTS {0} ON {1} {2}".format(
+                    index, table, definition))
+
     ##########################################################################
     #                             FIELDS METHODS                             #
     ##########################################################################
@@ -75,71 +94,162 @@ class StatementCompletionRule(models.Model):
             'account_id': value,
             ...}
         """
+        return self.auto_complete_lines(stmts_vals, [stmt_line])[0]
+
+    @api.multi
+    def auto_complete_lines(self, stmts_vals, st_lines):
+        """This method will execute all related rules, in their sequence order,
+        on all given lines at once. Each rule receives the lines that
+        previous rules didn't match.
+        A rule can process all lines at once by implementing a method named
+        after its function_to_call with suffix _batch, receiving the list of
+        lines and returning a dict {position in the list: values}.
+        Otherwise it is called for each line.
+        :param stmts_vals: dict with bank statement values
+        :param st_lines: list of dict with statement line values
+        :return: list of dict of values for each statement line, or {}
+                 when no rule matched the line.
+        """
+        results = [dict() for st_line in st_lines]
+        to_match = range(len(st_lines))
         for rule in self.sorted(key=lambda r: r.sequence):
-            method = getattr(self, rule.function_to_call)
-            result = method(stmts_vals, stmt_line)
+            if not to_match:
+                break
+            matched = self._call_rule(
+                rule, stmts_vals, [st_lines[i] for i in to_match])
+            not_matched = list()
+            for position, index in enumerate(to_match):
+                if matched.get(position):
+                    results[index] = matched[position]
+                else:
+                    not_matched.append(index)
+            to_match = not_matched
+        return results
+
+    def _call_rule(self, rule, stmts_vals, st_lines):
+        """ Calls the method of a rule on the given lines.
+        :return: dict {position of the line in st_lines: values}
+        """
+        batch_method = getattr(self, rule.function_to_call + '_batch', None)
+        if batch_method:
+            return batch_method(stmts_vals, st_lines)
+        method = getattr(self, rule.function_to_call)
+        res = dict()
+        for position, st_line in enumerate(st_lines):
+            result = method(stmts_vals, st_line)
             if result:
-                return result
-        return dict()
+                res[position] = result
+        return res
 
     def get_from_amount(self, stmts_vals, st_line):
         """ If line amount match an open supplier invoice,
             update partner and account. """
-        amount = st_line['amount']
-        res = {}
-        # We check only for debit entries
-        if amount < 0:
-            invoice_obj = self.env['account.invoice']
-            invoices = invoice_obj.search(
-                [('type', '=', 'in_invoice'), ('state', '=', 'open'),
-                 ('amount_total', '=', abs(amount))])
-            res = {}
-            if invoices:
-                if len(invoices) == 1:
-                    partner = invoices.partner_id
-                    res['partner_id'] = partner.commercial_partner_id.id
-                else:
-                    partner = invoices[0].partner_id
-                    for invoice in invoices:
-                        if invoice.partner_id.id != partner.id:
-                            logger.warning(
-                                'Line named "%s" (Ref:%s) was matched by '
-                                'more than one invoice while looking on open'
-                                ' supplier invoices' %
-                                (st_line['name'], st_line['ref']))
-                    res['partner_id'] = partner.commercial_partner_id.id
-        return res
+        return self.get_from_amount_batch(stmts_vals, [st_line]).get(
+            0, dict())
 
-    def get_from_move_line_ref(self, stmts_vals, st_line):
-        ''' Update partner if same reference is found '''
-        ref = st_line.get('ref')
+    def get_from_amount_batch(self, stmts_vals, st_lines):
+        """ Batch version of get_from_amount: open supplier invoices
+            matching the amounts of all lines are read at once. """
         res = dict()
-        if not ref:
+        # We check only for debit entries
+        amounts = set(abs(l['amount']) for l in st_lines if l['amount'] < 0)
+        if not amounts:
             return res
-        partner = None
-
-        # Search move lines
-        move_line_obj = self.env['account.move.line']
-        move_lines = move_line_obj.search(
-            [('ref', '=', ref), ('partner_id', '!=', None)])
-        if move_lines:
-            partner = move_lines[0].partner_id
-
-        if partner:
-            res['partner_id'] = partner.id
+        partners_by_amount = self._get_supplier_invoice_partners(amounts)
+        for position, st_line in enumerate(st_lines):
+            amount = st_line['amount']
+            partners = amount < 0 and partners_by_amount.get(abs(amount))
+            if not partners:
+                continue
+            partner_id, commercial_partner_id = partners[0]
+            for other_partner_id, other_commercial_id in partners[1:]:
+                if other_partner_id != partner_id:
+                    logger.warning(
+                        'Line named "%s" (Ref:%s) was matched by '
+                        'more than one invoice while looking on open'
+                        ' supplier invoices' %
+                        (st_line['name'], st_line['ref']))
+            res[position] = {'partner_id': commercial_partner_id}
+        return res
 
+    def _get_supplier_invoice_partners(self, amounts):
+        """ Reads the partners of open supplier invoices having one of the
+            given amounts.
+        :param amounts: set of invoice totals
+        :return: dict {amount_total: [(partner_id, commercial_partner_id)]}
+                 in the order of the invoices.
+        """
+        invoices = self.env['account.invoice'].search([
+            ('type', '=', 'in_invoice'), ('state', '=', 'open'),
+            ('amount_total', 'in', list(amounts))])
+        res = dict()
+        for invoice in invoices:
+            partner = invoice.partner_id
+            res.setdefault(invoice.amount_total, list()).append(
+                (partner.id, partner.commercial_partner_id.id))
         return res
 
+    def get_from_move_line_ref(self, stmts_vals, st_line):
+        ''' Update partner if same reference is found '''
+        return self.get_from_move_line_ref_batch(stmts_vals, [st_line]).get(
+            0, dict())
+
+    def get_from_move_line_ref_batch(self, stmts_vals, st_lines):
+        """ Batch version of get_from_move_line_ref: the partner of the
+            first move line (in the move lines order) of each reference is
+            read with one query. """
+        refs = list(set(line['ref'] for line in st_lines if line.get('ref')))
+        if not refs:
+            return dict()
+        partners = self._get_partners_by_ref(
+            'account.move.line', 'ref', refs, [('partner_id', '!=', False)])
+        return {
+            position: {'partner_id': partners[st_line['ref']]}
+            for position, st_line in enumerate(st_lines)
+            if st_line.get('ref') in partners
+        }
+
     def get_from_payment_line(self, stmt_vals, st_line):
         """ Search in account.payment.line """
-        ref = st_line.get('ref')
-        res = dict()
-        if not ref:
-            return res
+        return self.get_from_payment_line_batch(stmt_vals, [st_line]).get(
+            0, dict())
 
-        payment_line = self.env['bank.payment.line'].search([
-            ('name', '=', ref)
-        ], limit=1, order='date desc')
-        if payment_line:
-            res['partner_id'] = payment_line.partner_id.id
-        return res
+    def get_from_payment_line_batch(self, stmt_vals, st_lines):
+        """ Batch version of get_from_payment_line: the partner of the
+            latest payment line of each reference is read with one query.
+        """
+        refs = list(set(line['ref'] for line in st_lines if line.get('ref')))
+        if not refs:
+            return dict()
+        partners = self._get_partners_by_ref('bank.payment.line', 'name', refs)
+        return {
+            position: {'partner_id': partners[st_line['ref']] or False}
+            for position, st_line in enumerate(st_lines)
+            if st_line.get('ref') in partners
+        }
+
+    def _get_partners_by_ref(self, model, ref_field, refs, domain=None):
+        """ Reads with one query the partner of the latest record (by date
+            and id) having each of the given references. The record rules
+            of the model are applied as in a search.
+        :param model: name of the model searched
+        :param ref_field: name of the reference column
+        :param refs: list of references
+        :param domain: additional search domain
+        :return: dict {ref: partner_id}
+        """
+        record_obj = self.env[model]
+        query = record_obj._where_calc(
+            [(ref_field, 'in', refs)] + (domain or list()))
+        record_obj._apply_ir_rules(query, 'read')
+        from_clause, where_clause, params = query.get_sql()
+        self.env.cr.execute("""
+            SELECT DISTINCT ON ("{table}".{ref}) "{table}".{ref},
+                   "{table}".partner_id
+            FROM {from_clause}
+            WHERE {where_clause}
+            ORDER BY "{table}".{ref}, "{table}".date DESC, "{table}".id DESC
+        """.format(table=record_obj._table, ref=ref_field,
+                   from_clause=from_clause, where_clause=where_clause),
+            params)
+        return dict(self.env.cr.fetchall())
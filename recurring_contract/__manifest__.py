@@ -35,7 +35,8 @@
     'author': 'Compassion CH',
     'website': 'http://www.compassion.ch',
     'category': 'Accounting',
-    'depends': ['account_payment_partner', 'queue_job', 'account_cancel'],
+    'depends': ['account_payment_partner', 'queue_job', 'account_cancel',
+                'account_company_defaults'],
     'external_dependencies': {},
     'data': [
         'views/contract_group_view.xml',
@@ -13,13 +13,19 @@ import logging
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
-from odoo import api, fields, models, _
+from odoo import api, fields, models, tools, _
 from odoo.tools import DEFAULT_SERVER_DATE_FORMAT as DF
 
 from odoo.addons.queue_job.job import job, related_action
 
 logger = logging.getLogger(__name__)
 
+# Number of contract groups processed together by the invoice generation
+GENERATION_BATCH_SIZE = 500
+# Channel on which the shards of a parallel generation are enqueued. Its
+# capacity is set in the queue_job configuration of the server.
+SHARD_CHANNEL = 'root.recurring_invoicer_shard'
+
 
 class ContractGroup(models.Model):
     _name = 'recurring.contract.group'
@@ -75,17 +81,46 @@ class ContractGroup(models.Model):
 
     @api.depends('contract_ids.next_invoice_date', 'contract_ids.state')
     def _compute_next_invoice_date(self):
+        """ Computed with one aggregate query for all groups. When writing
+        many contracts, use context recompute=False and call recompute()
+        at the end, so that each group is computed only once. """
+        gen_states = self._get_gen_states()
+        next_dates = dict()
+        if self.ids:
+            # A contract without next_invoice_date prevents the group
+            # from being invoiced.
+            self.env.cr.execute("""
+                SELECT group_id,
+                       CASE WHEN count(*) = count(next_invoice_date)
+                       THEN min(next_invoice_date) END
+                FROM recurring_contract
+                WHERE group_id = ANY(%s) AND state = ANY(%s)
+                GROUP BY group_id
+            """, (self.ids, gen_states))
+            next_dates = dict(self.env.cr.fetchall())
         for group in self:
-            next_inv_date = min(
-                [c.next_invoice_date for c in group.contract_ids
-                 if c.state in self._get_gen_states()] or [False])
-            group.next_invoice_date = next_inv_date
+            if group.id:
+                group.next_invoice_date = next_dates.get(group.id) or False
+            else:
+                group.next_invoice_date = min(
+                    [c.next_invoice_date for c in group.contract_ids
+                     if c.state in gen_states] or [False])
 
     def _compute_last_paid_invoice(self):
+        last_paid = dict()
+        if self.ids:
+            self.env.cr.execute("""
+                SELECT c.group_id, max(i.date_invoice)
+                FROM recurring_contract c
+                JOIN account_invoice_line l ON l.contract_id = c.id
+                JOIN account_invoice i ON i.id = l.invoice_id
+                WHERE c.group_id = ANY(%s) AND l.state = 'paid'
+                GROUP BY c.group_id
+            """, (self.ids,))
+            last_paid = dict(self.env.cr.fetchall())
         for group in self:
-            group.last_paid_invoice_date = max(
-                [c.last_paid_invoice_date for c in group.contract_ids] or
-                [False])
+            group.last_paid_invoice_date = fields.Date.to_string(
+                last_paid.get(group.id))
 
     ##########################################################################
     #                              ORM METHODS                               #
@@ -125,7 +160,9 @@ class ContractGroup(models.Model):
             the task immediately.
         """
         if self.env.context.get('async_mode', True):
-            self.with_delay()._clean_generate_invoices()
+            if not self.env['queue.job']._merge_pending_job(
+                    self, '_clean_generate_invoices'):
+                self.with_delay()._clean_generate_invoices()
         else:
             self._clean_generate_invoices()
         return True
@@ -140,22 +177,52 @@ class ContractGroup(models.Model):
             Context value async_mode set to False can force to perform
             the task immediately.
         """
+        if self.env.context.get('async_mode', True) and invoicer is None:
+            # Generate the groups with a pending generation job
+            job = self.env['queue.job']._merge_pending_job(
+                self, '_generate_invoices', compare_args=False)
+            if job:
+                return job.args and job.args[0] or \
+                    self.env['recurring.invoicer']
         if invoicer is None:
             invoicer = self.env['recurring.invoicer'].create(
                 {'source': self._name})
         if self.env.context.get('async_mode', True):
-            # Prevent two generations at the same time
-            jobs = self.env['queue.job'].search([
-                ('channel', '=', 'root.recurring_invoicer'),
-                ('state', '=', 'started')])
-            delay = datetime.today()
-            if jobs:
-                delay += relativedelta(minutes=1)
-            self.with_delay(eta=delay)._generate_invoices(invoicer)
+            # Concurrent generations skip the groups they can't lock
+            self.with_delay()._generate_invoices(invoicer)
         else:
             self._generate_invoices(invoicer)
         return invoicer
 
+    @api.multi
+    def generate_invoices_sharded(self, invoicer=None, shard_size=None):
+        """ Splits the groups into shards not sharing any partner and
+            launches one job per shard, so that the shards can be generated
+            in parallel on the shard channel. All shards are attached to
+            the same invoicer.
+            Context value async_mode set to False can force to perform
+            the task immediately.
+        :param shard_size: maximum number of groups in a shard. Defaults to
+                           the system parameter
+                           recurring_contract.invoicer_shard_size
+        :return: recurring.invoicer record
+        """
+        if invoicer is None:
+            invoicer = self.env['recurring.invoicer'].create(
+                {'source': self._name})
+        if not shard_size:
+            shard_size = int(self.env['ir.config_parameter'].sudo().get_param(
+                'recurring_contract.invoicer_shard_size',
+                GENERATION_BATCH_SIZE))
+        async_mode = self.env.context.get('async_mode', True)
+        for shard in self._get_partner_shards(shard_size):
+            if async_mode:
+                shard.with_delay(channel=SHARD_CHANNEL)._generate_invoices(
+                    invoicer)
+            else:
+                shard._generate_invoices(invoicer)
+        return invoicer
+
     @api.multi
     def get_relative_delta(self):
         """
@@ -163,8 +230,17 @@ class ContractGroup(models.Model):
         :return: datetime.relativedelta object
         """
         self.ensure_one()
-        rec_unit = self.recurring_unit
-        rec_value = self.recurring_value
+        return self._get_relative_delta(
+            self.recurring_unit, self.recurring_value)
+
+    @api.model
+    @tools.ormcache('rec_unit', 'rec_value')
+    def _get_relative_delta(self, rec_unit, rec_value):
+        """
+        Get a relative delta given recurring settings. The result is cached
+        as only a few different recurrences exist.
+        :return: datetime.relativedelta object
+        """
         if rec_unit == 'day':
             r = relativedelta(days=+rec_value)
         elif rec_unit == 'week':
@@ -184,24 +260,125 @@ class ContractGroup(models.Model):
     def _generate_invoices(self, invoicer=None):
         """ Checks all contracts and generate invoices if needed.
         Create an invoice per contract group per date.
+        Groups are processed by batches: if a batch fails, its groups are
+        generated again one by one so that only the faulty groups are
+        skipped.
         """
         logger.info("Invoice generation started.")
         if invoicer is None:
             invoicer = self.env['recurring.invoicer'].create(
                 {'source': self._name})
+        company = self.env.ref('base.main_company')
+        journal = self.env['account.journal'].browse(
+            company._get_accounting_defaults(company.id)['sale_journal_id'])
+        groups = self.filtered('next_invoice_date')
+        nb_groups = len(groups)
+        batch_size = self.env.context.get(
+            'invoicer_batch_size', GENERATION_BATCH_SIZE)
+        for index in range(0, nb_groups, batch_size):
+            batch = groups[index:index + batch_size]
+            # After a batch is done, we commit all writes in order to
+            # avoid doing it again in case of an error or a timeout
+            self.env.cr.commit()
+            logger.info("Generating invoices for groups {0}-{1}/{2}".format(
+                index + 1, index + len(batch), nb_groups))
+            locked = batch._lock_groups()
+            if locked != batch:
+                logger.warning(
+                    'contract groups {0} are already being generated, they '
+                    'are skipped'.format((batch - locked).ids))
+            try:
+                locked._generate_invoices_bulk(journal, invoicer)
+            except:
+                self.env.cr.rollback()
+                self.env.invalidate_all()
+                logger.error(
+                    'batch of contract groups {0} failed during invoice '
+                    'generation, retrying group by group'.format(locked.ids),
+                    exc_info=True)
+                locked._generate_invoices_per_group(journal, invoicer)
+        logger.info("Invoice generation successfully finished.")
+        return invoicer
+
+    def _generate_invoices_bulk(self, journal, invoicer):
+        """ Generate the invoices of all given groups at once: the contracts
+        to invoice are fetched with one query, the periods are replayed in
+        memory, then all invoices are validated together and the
+        next_invoice_date of contracts are updated with one write per date.
+        While building the invoices of a period, the next_invoice_date of
+        the group and its contracts hold in the cache the values they would
+        have in the group by group generation.
+        """
+        contract_obj = self.env['recurring.contract']
         inv_obj = self.env['account.invoice']
-        gen_states = self._get_gen_states()
-        journal = self.env['account.journal'].search(
-            [('type', '=', 'sale'), ('company_id', '=', 1)], limit=1)
+        contracts_data = self._get_contracts_to_invoice()
+        contract_ids = [
+            c[0] for data in contracts_data.itervalues() for c in data]
+        self._prefetch_inv_data(journal, contract_obj.browse(contract_ids))
+        # Environments in which _setup_inv_data reads the dates. The records
+        # are fully loaded in them first, so that reading another field
+        # doesn't fetch again the dates set below.
+        envs = [self.env, contract_obj.with_context(
+            journal_id=journal.id, type='out_invoice').env]
+        for env in envs:
+            self.with_env(env).mapped('next_invoice_date')
+            contract_obj.with_env(env).browse(contract_ids).mapped(
+                'next_invoice_date')
+        group_field = self._fields['next_invoice_date']
+        contract_field = contract_obj._fields['next_invoice_date']
+        invoice_ids = list()
+        new_dates = dict()
+        for group in self:
+            month_delta = group.advance_billing_months or 1
+            limit_date = datetime.today() + relativedelta(
+                months=+month_delta)
+            periods, next_dates = group._get_invoicing_periods(
+                contracts_data.get(group.id, list()), limit_date)
+            for invoice_date, contract_dates in periods:
+                for env in envs:
+                    env.cache[group_field][group.id] = invoice_date.strftime(
+                        DF)
+                    for contract_id, next_date in contract_dates:
+                        env.cache[contract_field][contract_id] = \
+                            next_date.strftime(DF)
+                inv_data = group._setup_inv_data(
+                    journal, invoicer,
+                    contract_obj.browse([c[0] for c in contract_dates]))
+                inv_data['date_invoice'] = invoice_date.strftime(DF)
+                invoice_ids.append(inv_obj.create(inv_data).id)
+            new_dates.update(next_dates)
+        self.invalidate_cache(['next_invoice_date'], self.ids)
+        contract_obj.invalidate_cache(['next_invoice_date'], contract_ids)
 
+        invoices = inv_obj.browse(invoice_ids)
+        empty_invoices = invoices.filtered(lambda i: not i.invoice_line_ids)
+        empty_invoices.unlink()
+        (invoices - empty_invoices).action_invoice_open()
+
+        if not self.env.context.get('no_next_date_update'):
+            contract_obj._write_next_invoice_dates({
+                contract_id: next_date and next_date.strftime(DF) or False
+                for contract_id, next_date in new_dates.iteritems()
+            })
+        return invoices - empty_invoices
+
+    def _generate_invoices_per_group(self, journal, invoicer):
+        """ Generate invoices group by group. Each group is committed
+        separately, a failing group is rolled back and skipped. """
+        inv_obj = self.env['account.invoice']
+        gen_states = self._get_gen_states()
         nb_groups = len(self)
         count = 1
-        for contract_group in self.filtered('next_invoice_date'):
-            # After a ContractGroup is done, we commit all writes in order to
-            # avoid doing it again in case of an error or a timeout
+        for contract_group in self:
             self.env.cr.commit()
             logger.info("Generating invoices for group {0}/{1}".format(
                 count, nb_groups))
+            count += 1
+            if not contract_group._lock_groups():
+                logger.warning(
+                    'contract group {0} is already being generated, it is '
+                    'skipped'.format(contract_group.id))
+                continue
             month_delta = contract_group.advance_billing_months or 1
             limit_date = datetime.today() + relativedelta(
                 months=+month_delta)
@@ -236,9 +413,135 @@ class ContractGroup(models.Model):
                         format(contract_group.id),
                         exc_info=True)
                     break
-            count += 1
-        logger.info("Invoice generation successfully finished.")
-        return invoicer
+        return True
+
+    def _get_partner_shards(self, shard_size):
+        """ Splits the groups into shards of at most shard_size groups
+        (unless a partner has more groups), all groups of a partner being
+        put in the same shard.
+        :return: list of recurring.contract.group recordsets
+        """
+        groups_by_partner = dict()
+        for group in self:
+            groups_by_partner.setdefault(
+                group.partner_id.id, list()).append(group.id)
+        shards = list()
+        shard_ids = list()
+        for partner_id in sorted(groups_by_partner):
+            group_ids = groups_by_partner[partner_id]
+            if shard_ids and len(shard_ids) + len(group_ids) > shard_size:
+                shards.append(self.browse(shard_ids))
+                shard_ids = list()
+            shard_ids.extend(group_ids)
+        if shard_ids:
+            shards.append(self.browse(shard_ids))
+        return shards
+
+    def _lock_groups(self):
+        """ Locks the groups until the end of the current transaction.
+        Groups already locked by another transaction are not waited for.
+        :return: the groups that could be locked
+        """
+        if not self.ids:
+            return self
+        self.env.cr.execute("""
+            SELECT id FROM recurring_contract_group
+            WHERE id = ANY(%s)
+            FOR UPDATE SKIP LOCKED
+        """, (self.ids,))
+        locked_ids = set(r[0] for r in self.env.cr.fetchall())
+        return self.filtered(lambda g: g.id in locked_ids)
+
+    def _get_contracts_to_invoice(self):
+        """ Fetch with one query the contracts of the groups that are in a
+        state allowing invoice generation. As for the next_invoice_date of
+        the group, a contract without next_invoice_date prevents the group
+        from being invoiced: such groups are left out of the result.
+        :return: dict {group_id: [(contract_id, next_invoice_date, end_date)]}
+                 where dates are datetime objects (end_date can be None).
+        """
+        res = dict()
+        if not self.ids:
+            return res
+        self.env.cr.execute("""
+            SELECT group_id, id, next_invoice_date, end_date
+            FROM recurring_contract
+            WHERE group_id = ANY(%s) AND state = ANY(%s)
+            ORDER BY group_id, id
+        """, (self.ids, self._get_gen_states()))
+        undated_group_ids = set()
+        for group_id, contract_id, next_date, end_date in \
+                self.env.cr.fetchall():
+            if not next_date:
+                undated_group_ids.add(group_id)
+                continue
+            res.setdefault(group_id, list()).append((
+                contract_id, datetime.strptime(next_date, DF),
+                end_date and datetime.strptime(end_date, DF)))
+        for group_id in undated_group_ids:
+            res.pop(group_id, None)
+        return res
+
+    def _get_invoicing_periods(self, contracts_data, limit_date):
+        """ Replays in memory the generation loop of the group: at each
+        period, the contracts whose next_invoice_date is reached are
+        invoiced and their next_invoice_date is moved by
+        _compute_next_invoice_date, called once per date like in
+        update_next_invoice_date.
+        :param contracts_data: list of (contract_id, next_invoice_date,
+                               end_date) as given by
+                               _get_contracts_to_invoice
+        :param limit_date: datetime after which no invoice is generated
+        :return: tuple (periods, next_dates) where periods is a list of
+                 (invoice_date, [(contract_id, next_invoice_date)]) giving
+                 the contracts invoiced at each period with their date at
+                 that period, and next_dates is a dict
+                 {contract_id: new next_invoice_date} of modified contracts
+        """
+        self.ensure_one()
+        update_dates = not self.env.context.get('no_next_date_update')
+        delta = self.get_relative_delta()
+        contract_ids = [c[0] for c in contracts_data]
+        next_dates = {c[0]: c[1] for c in contracts_data}
+        end_dates = {c[0]: c[2] for c in contracts_data}
+        periods = list()
+        modified = set()
+        current_date = fields.Datetime.from_string(self.next_invoice_date)
+        invoice_date = current_date
+        while current_date <= limit_date:
+            to_invoice = [
+                cid for cid in contract_ids
+                if next_dates[cid] and next_dates[cid] <= current_date and
+                not (end_dates[cid] and end_dates[cid] >= next_dates[cid])
+            ]
+            if not to_invoice:
+                break
+            periods.append((invoice_date, [
+                (cid, next_dates[cid]) for cid in to_invoice]))
+            if update_dates:
+                new_dates = dict()
+                for cid in to_invoice:
+                    if next_dates[cid] not in new_dates:
+                        new_dates[next_dates[cid]] = \
+                            self._get_contract_next_date(
+                                cid, next_dates[cid])
+                    next_dates[cid] = new_dates[next_dates[cid]]
+                modified.update(to_invoice)
+                invoice_date = min(
+                    [d for d in next_dates.values() if d] or [current_date])
+            current_date += delta
+        return periods, {cid: next_dates[cid] for cid in modified}
+
+    def _get_contract_next_date(self, contract_id, next_date):
+        """ Gives the date following next_date for the contract, computed by
+        _compute_next_invoice_date with next_date set in the cache.
+        :return: datetime or None if the contract is not invoiced anymore
+        """
+        contract = self.env['recurring.contract'].browse(contract_id)
+        field = contract._fields['next_invoice_date']
+        self.env.cache[field][contract_id] = next_date.strftime(DF)
+        new_date = contract._compute_next_invoice_date()
+        return new_date and datetime.strptime(new_date, DF) or None
 
     @api.multi
     @job(default_channel='root.recurring_invoicer')
@@ -257,7 +560,8 @@ class ContractGroup(models.Model):
                 since_date = max(since_date, last_paid_invoice_date)
             res += group.contract_ids._clean_invoices(
                 since_date=since_date.strftime(DF))
-            group.contract_ids.rewind_next_invoice_date()
+        # Rewind the contracts of all groups with one query
+        self.mapped('contract_ids').rewind_next_invoice_date()
         # Generate again invoices
         self._generate_invoices()
         return res
@@ -275,6 +579,27 @@ class ContractGroup(models.Model):
     def _get_gen_states(self):
         return ['active']
 
+    def _prefetch_inv_data(self, journal, contracts):
+        """ Loads at once in the cache the records used by _setup_inv_data
+        and get_inv_lines_data to build the invoices of the given contracts:
+        partners with their receivable account and currency, contract lines
+        and products with their income account. Building the invoice values
+        of a whole batch then doesn't read records one by one.
+        If you read other records to setup invoices, inherit this method.
+        """
+        partners = self.mapped('partner_id')
+        partners.mapped('property_account_receivable_id')
+        partners.mapped('property_product_pricelist.currency_id')
+        self.mapped('payment_mode_id')
+        # Use the same context as _setup_inv_data, as the cache depends
+        # on the environment.
+        contracts = contracts.with_context(journal_id=journal.id,
+                                           type='out_invoice')
+        products = contracts.mapped('contract_line_ids.product_id')
+        products.mapped('name')
+        products.mapped('property_account_income_id')
+        return True
+
     def _setup_inv_data(self, journal, invoicer, contracts):
         """ Setup a dict with data passed to invoice.create.
             If any custom data is wanted in invoice from contract group, just
@@ -285,13 +610,14 @@ class ContractGroup(models.Model):
         # set context for invoice_line creation
         contracts = contracts.with_context(journal_id=journal.id,
                                            type='out_invoice')
+        defaults = self.env['res.company']._get_accounting_defaults(
+            journal.company_id.id)
         inv_data = {
             'account_id': partner.property_account_receivable_id.id,
             'type': 'out_invoice',
             'partner_id': partner.id,
             'journal_id': journal.id,
-            'payment_term_id': self.env.ref(
-                'account.account_payment_term_immediate').id,
+            'payment_term_id': defaults['payment_term_id'],
             'currency_id':
             partner.property_product_pricelist.currency_id.id,
             'date_invoice': self.next_invoice_date,
@@ -11,10 +11,78 @@
 
 from odoo import api, models, _
 
+# Channel whose pending jobs are merged together
+COALESCE_CHANNEL = 'root.recurring_invoicer'
+
 
 class QueueJob(models.Model):
     _inherit = 'queue.job'
 
+    @api.model
+    def _merge_pending_job(self, records, method_name, args=None,
+                           kwargs=None, compare_args=True):
+        """ Adds the records to a pending job of the recurring invoicer
+        channel calling the same method on some of the same records, so
+        that editing the same records several times doesn't enqueue
+        overlapping jobs. Jobs not sharing any record are never merged,
+        which keeps their size bounded by the records edited together.
+        Only the jobs enqueued by the current transaction are merged: a
+        committed job could be started by the job runner before the merge
+        is committed, and the added records would be lost.
+        :param records: recordset on which the job would be delayed
+        :param method_name: name of the delayed method
+        :param args: positional arguments of the delayed method
+        :param kwargs: keyword arguments of the delayed method
+        :param compare_args: merge only into a job having the same arguments
+        :return: the merged queue.job or an empty recordset if none was found
+        """
+        if not records.ids:
+            return self.browse()
+        args = list(args or list())
+        kwargs = kwargs or dict()
+        self.env.cr.execute("""
+            SELECT id FROM queue_job
+            WHERE state = 'pending' AND channel = %s
+            AND model_name = %s AND method_name = %s
+            AND EXISTS (
+                SELECT 1
+                FROM jsonb_array_elements_text(record_ids::jsonb) AS r(id)
+                WHERE r.id::integer = ANY(%s))
+            ORDER BY date_created DESC, id DESC
+        """, (COALESCE_CHANNEL, records._name, method_name, records.ids))
+        jobs = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if compare_args:
+            jobs = jobs.filtered(
+                lambda j: list(j.args or list()) == args and
+                (j.kwargs or dict()) == kwargs)
+        if not jobs:
+            return self.browse()
+
+        # The jobs visible from a new transaction are already committed.
+        with self.env.registry.cursor() as cr:
+            cr.execute("SELECT id FROM queue_job WHERE id = ANY(%s)",
+                       (jobs.ids,))
+            committed_ids = [row[0] for row in cr.fetchall()]
+        for job in jobs:
+            if job.id not in committed_ids:
+                job._add_records(records)
+                return job
+        return self.browse()
+
+    @api.multi
+    def _add_records(self, records):
+        """ Adds the records to the ones of the job. """
+        self.ensure_one()
+        old_records = records.browse(self.record_ids)
+        new_records = old_records | records
+        if new_records != old_records:
+            self.write({
+                'record_ids': new_records.ids,
+                'func_string': self.func_string.replace(
+                    repr(old_records), repr(new_records), 1),
+            })
+        return True
+
     @api.multi
     def related_action_invoicer(self, invoicer=None):
         self.ensure_one()
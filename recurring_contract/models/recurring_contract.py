@@ -23,6 +23,9 @@ from odoo.tools import DEFAULT_SERVER_DATE_FORMAT as DF
 
 _logger = logging.getLogger(__name__)
 
+# Number of terminated contracts cleaned by one job
+CLEANING_CHUNK_SIZE = 500
+
 
 class ContractLine(models.Model):
     """ Each product sold through a contract """
@@ -133,17 +136,37 @@ class RecurringContract(models.Model):
             ])
 
     def _compute_last_paid_invoice(self):
+        stats = self._get_invoices_stats()
         for contract in self:
-            contract.last_paid_invoice_date = max(
-                [invl.invoice_id.date_invoice for invl in
-                 contract.invoice_line_ids if invl.state == 'paid'] or [False])
+            contract.last_paid_invoice_date = stats.get(
+                contract.id, (0, False))[1]
 
     def _compute_invoices(self):
+        stats = self._get_invoices_stats()
         for contract in self:
-            contract.nb_invoices = len(
-                contract.mapped('invoice_line_ids.invoice_id').filtered(
-                    lambda i: i.state not in ('cancel', 'draft')
-                ))
+            contract.nb_invoices = stats.get(contract.id, (0, False))[0]
+
+    def _get_invoices_stats(self):
+        """ Reads with one grouped query the invoices of the contracts.
+        :return: dict {contract_id: (number of validated invoices,
+                                     last paid invoice date)}
+        """
+        if not self.ids:
+            return dict()
+        self.env.cr.execute("""
+            SELECT l.contract_id,
+                   count(DISTINCT CASE WHEN i.state NOT IN ('cancel', 'draft')
+                                  THEN i.id END),
+                   max(CASE WHEN l.state = 'paid' THEN i.date_invoice END)
+            FROM account_invoice_line l
+            JOIN account_invoice i ON i.id = l.invoice_id
+            WHERE l.contract_id = ANY(%s)
+            GROUP BY l.contract_id
+        """, (self.ids,))
+        return {
+            contract_id: (nb_invoices, fields.Date.to_string(last_paid))
+            for contract_id, nb_invoices, last_paid in self.env.cr.fetchall()
+        }
 
     ##########################################################################
     #                              ORM METHODS                               #
@@ -210,43 +233,75 @@ class RecurringContract(models.Model):
             the task immediately.
         """
         if self.env.context.get('async_mode', True):
-            self.with_delay()._clean_invoices(since_date, to_date, keep_lines)
+            if not self.env['queue.job']._merge_pending_job(
+                    self, '_clean_invoices',
+                    args=(since_date, to_date, keep_lines)):
+                self.with_delay()._clean_invoices(
+                    since_date, to_date, keep_lines)
         else:
             self._clean_invoices(since_date, to_date, keep_lines)
 
     def rewind_next_invoice_date(self):
         """ Rewinds the next invoice date of contract after the last
-        generated invoice. No open invoices exist after that date. """
+        generated invoice. No open invoices exist after that date.
+        The last open or paid invoice date and the first cancelled invoice
+        date of all contracts are fetched with one query. The contracts
+        are then moved after their last invoice by update_next_invoice_date,
+        so that the date is computed by _compute_next_invoice_date. """
+        if not self.ids:
+            return True
         gen_states = self.env['recurring.contract.group']._get_gen_states()
-        for contract in self.with_context(allow_rewind=True):
-            if contract.state in gen_states:
-                last_invoice_date = max([
-                    datetime.strptime(line.invoice_id.date_invoice, DF) for
-                    line in contract.invoice_line_ids
-                    if line.state in ('open', 'paid')] or [False])
-                if last_invoice_date:
-                    contract.write({
-                        'next_invoice_date': last_invoice_date.strftime(DF)})
-                    contract.update_next_invoice_date()
-                else:
-                    # No open/paid invoices, look for cancelled ones
-                    next_invoice_date = min([
-                        datetime.strptime(line.invoice_id.date_invoice, DF)
-                        for line in contract.invoice_line_ids
-                        if line.state == 'cancel'] or [False])
-                    if next_invoice_date:
-                        contract.write({
-                            'next_invoice_date':
-                            next_invoice_date.strftime(DF)})
-
-        return True
+        self.env.cr.execute("""
+            SELECT l.contract_id,
+                   max(CASE WHEN i.state IN ('open', 'paid')
+                       THEN i.date_invoice END),
+                   min(CASE WHEN i.state = 'cancel'
+                       THEN i.date_invoice END)
+            FROM account_invoice_line l
+            JOIN account_invoice i ON l.invoice_id = i.id
+            JOIN recurring_contract c ON l.contract_id = c.id
+            WHERE c.id = ANY(%s) AND c.state = ANY(%s)
+            GROUP BY l.contract_id
+        """, (self.ids, gen_states))
+        next_dates = dict()
+        invoiced_ids = list()
+        for contract_id, last_invoice_date, cancel_date in \
+                self.env.cr.fetchall():
+            if last_invoice_date:
+                next_dates[contract_id] = last_invoice_date
+                invoiced_ids.append(contract_id)
+            elif cancel_date:
+                # No open/paid invoices, look for cancelled ones
+                next_dates[contract_id] = cancel_date
+
+        contracts = self.with_context(allow_rewind=True)
+        contracts._write_next_invoice_dates(next_dates)
+        return contracts.browse(invoiced_ids).update_next_invoice_date()
 
     def update_next_invoice_date(self):
-        """ Recompute and set next_invoice date. """
-        for contract in self:
-            next_date = contract._compute_next_invoice_date()
-            contract.write({'next_invoice_date': next_date})
-        return True
+        """ Recompute and set next_invoice date. Contracts having the same
+        next_invoice_date and recurrence are moved together: each new date
+        is computed once, by _compute_next_invoice_date of the first
+        contract of its kind, and written with one write per date. """
+        if not self.ids:
+            return True
+        self.env.cr.execute("""
+            SELECT c.id, c.next_invoice_date,
+                   g.recurring_unit, g.recurring_value
+            FROM recurring_contract c
+            JOIN recurring_contract_group g ON c.group_id = g.id
+            WHERE c.id = ANY(%s) AND c.next_invoice_date IS NOT NULL
+        """, (self.ids,))
+        new_dates = dict()
+        next_dates = dict()
+        for contract_id, next_date, rec_unit, rec_value in \
+                self.env.cr.fetchall():
+            key = (next_date, rec_unit, rec_value)
+            if key not in new_dates:
+                new_dates[key] = self.browse(
+                    contract_id)._compute_next_invoice_date()
+            next_dates[contract_id] = new_dates[key]
+        return self._write_next_invoice_dates(next_dates)
 
     @api.multi
     def get_inv_lines_data(self):
@@ -341,13 +396,45 @@ class RecurringContract(models.Model):
                                  ('end_date', '<=', today)])
 
         if contracts:
-            contracts.signal_workflow('contract_terminated')
+            if self.env['ir.config_parameter'].get_param(
+                    'recurring_contract.bulk_termination') == 'True':
+                contracts._terminate_bulk()
+            else:
+                contracts.signal_workflow('contract_terminated')
 
         return True
 
     ##########################################################################
     #                             PRIVATE METHODS                            #
     ##########################################################################
+    @api.multi
+    def _terminate_bulk(self, chunk_size=CLEANING_CHUNK_SIZE):
+        """ Terminates all contracts at once, without going through the
+        workflow engine record by record: the state and end date are written
+        with one write, the workflow instances are moved to the terminated
+        activity with two queries, and the invoices are cleaned by chunks
+        of contracts.
+        Overrides of contract_terminated are not called in this mode.
+        """
+        today = datetime.today().strftime(DF)
+        self.write({'state': 'terminated', 'end_date': today})
+        self.env.cr.execute("""
+            UPDATE wkf_workitem w SET act_id = %s, state = 'complete'
+            FROM wkf_instance i
+            WHERE w.inst_id = i.id AND w.act_id = %s
+            AND i.res_type = %s AND i.res_id = ANY(%s)
+        """, (self.env.ref('recurring_contract.act_terminated').id,
+              self.env.ref('recurring_contract.act_active').id,
+              self._name, self.ids))
+        self.env.cr.execute("""
+            UPDATE wkf_instance SET state = 'complete'
+            WHERE res_type = %s AND res_id = ANY(%s)
+        """, (self._name, self.ids))
+        for index in range(0, len(self), chunk_size):
+            self[index:index + chunk_size].clean_invoices()
+        _logger.info("%s contracts terminated", len(self))
+        return True
+
     @api.multi
     @job(default_channel='root.recurring_invoicer')
     @related_action(action='related_action_contract')
@@ -360,33 +447,24 @@ class RecurringContract(models.Model):
         _logger.info("clean invoices called.")
         inv_lines = self._get_invoice_lines_to_clean(since_date, to_date)
         invoices = inv_lines.mapped('invoice_id')
-        empty_invoices = self.env['account.invoice']
-        to_remove_invl = self.env['account.invoice.line']
-
-        for inv_line in inv_lines:
-            invoice = inv_line.invoice_id
-            # Check if invoice is empty after removing the invoice_lines
-            # of the given contract
-            if invoice not in empty_invoices:
-                remaining_lines = invoice.invoice_line_ids.filtered(
-                    lambda l: not l.contract_id or l.contract_id not in self)
-                if remaining_lines:
-                    # We can move or remove the line
-                    to_remove_invl |= inv_line
-                else:
-                    # The invoice would be empty if we remove the line
-                    empty_invoices |= invoice
+        # Invoices keeping lines after removing the lines of the contracts
+        remaining_ids = self._get_invoices_with_other_lines(invoices)
+        empty_invoices = invoices.filtered(
+            lambda i: i.id not in remaining_ids)
+        # Lines of empty invoices are kept, as the invoice is cancelled
+        to_remove_invl = inv_lines.filtered(
+            lambda l: l.invoice_id.id in remaining_ids)
 
         if keep_lines:
             self._move_cancel_lines(to_remove_invl, keep_lines)
         else:
             invoices.action_invoice_cancel()
             invoices.action_invoice_draft()
-            invoices.env.invalidate_all()
+            self._invalidate_invoices_cache(invoices)
             to_remove_invl.unlink()
 
         # Refresh cache before calling workflows
-        self.env.invalidate_all()
+        self._invalidate_invoices_cache(invoices)
         # Invoices to set back in open state
         renew_invs = invoices - empty_invoices
         self._cancel_confirm_invoices(invoices, renew_invs, keep_lines)
@@ -404,7 +482,7 @@ class RecurringContract(models.Model):
         invoices = inv_lines.mapped('invoice_id')
         invoices.action_invoice_cancel()
         invoices.action_invoice_draft()
-        invoices.env.invalidate_all()
+        self._invalidate_invoices_cache(invoices)
         self._update_invoice_lines(invoices)
         invoices.action_invoice_open()
 
@@ -451,9 +529,53 @@ class RecurringContract(models.Model):
                      "\n\tinvoices to confirm : " + str(invoice_confirm.ids))
         invoice_cancel.action_invoice_cancel()
         invoice_confirm.action_invoice_draft()
-        invoice_confirm.env.invalidate_all()
+        self._invalidate_invoices_cache(invoice_confirm)
         invoice_confirm.action_invoice_open()
 
+    @api.multi
+    def _get_invoices_with_other_lines(self, invoices):
+        """ Finds with one query the invoices having lines that don't
+        belong to the contracts.
+        :param invoices: account.invoice recordset
+        :return: set of invoice ids
+        """
+        if not invoices:
+            return set()
+        self.env.cr.execute("""
+            SELECT DISTINCT invoice_id FROM account_invoice_line
+            WHERE invoice_id = ANY(%s)
+            AND (contract_id IS NULL OR NOT contract_id = ANY(%s))
+        """, (invoices.ids, self.ids or [0]))
+        return set(r[0] for r in self.env.cr.fetchall())
+
+    @api.model
+    def _invalidate_invoices_cache(self, invoices):
+        """ Invalidates the cache of invoices, of their lines and of their
+        journal entries after a change of state. """
+        invoices.invalidate_cache(ids=invoices.ids)
+        self.env['account.invoice.line'].invalidate_cache()
+        self.env['account.move'].invalidate_cache()
+        self.env['account.move.line'].invalidate_cache()
+
+    def _write_next_invoice_dates(self, next_dates):
+        """ Sets the next_invoice_date of contracts with one write per date.
+        The next_invoice_date of the groups is recomputed once after all
+        contracts are written.
+        :param next_dates: dict {contract_id: next_invoice_date string}
+        :return: True
+        """
+        contracts_by_date = dict()
+        for contract_id, next_date in next_dates.iteritems():
+            contracts_by_date.setdefault(next_date, list()).append(
+                contract_id)
+        contract_obj = self.with_context(recompute=False)
+        for next_date in sorted(contracts_by_date):
+            contract_obj.browse(contracts_by_date[next_date]).write({
+                'next_invoice_date': next_date})
+        if self.env.context.get('recompute', True):
+            self.recompute()
+        return True
+
     def _compute_next_invoice_date(self):
         """ Compute next_invoice_date for a single contract. """
         next_date = datetime.strptime(self.next_invoice_date, DF)
@@ -486,8 +608,8 @@ class RecurringContract(models.Model):
                 invoice.write({'invoice_line_ids': invl})
 
     def _on_change_next_invoice_date(self, new_invoice_date):
+        new_invoice_date = datetime.strptime(new_invoice_date, DF)
         for contract in self:
-            new_invoice_date = datetime.strptime(new_invoice_date, DF)
             if contract.next_invoice_date:
                 next_invoice_date = datetime.strptime(
                     contract.next_invoice_date, DF)
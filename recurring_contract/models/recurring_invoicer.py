@@ -35,6 +35,18 @@ class RecurringInvoicer(models.Model):
     invoice_ids = fields.One2many(
         'account.invoice', 'recurring_invoicer_id',
         'Generated invoices')
+    streaming = fields.Boolean(
+        readonly=True,
+        help='Set while the contract groups are being read by a streamed '
+             'generation. An interrupted generation is resumed.')
+    last_partner_id = fields.Integer(
+        'Last scheduled partner', readonly=True,
+        help='Id of the partner of the last contract group scheduled by a '
+             'streamed generation.')
+    last_group_id = fields.Integer(
+        'Last scheduled group', readonly=True,
+        help='Id of the last contract group scheduled by a streamed '
+             'generation.')
 
     def calculate_id(self):
         return self.env['ir.sequence'].next_by_code('rec.invoicer.ident')
@@ -9,6 +9,10 @@
 #
 ##############################################################################
 
+from datetime import date
+from dateutil.relativedelta import relativedelta
+from mock import patch
+
 from odoo import fields
 from odoo.tests.common import TransactionCase
 import logging
@@ -111,6 +115,8 @@ class TestRecurringContract(BaseContractTest):
         nb_invoice = len(invoices)
         # 2 invoices must be generated with our parameters
         self.assertEqual(nb_invoice, 2)
+        self.assertEqual(contract.nb_invoices, 2)
+        self.assertFalse(contract.last_paid_invoice_date)
         invoice = invoices[1]
         self.assertEqual(original_product, invoice.invoice_line_ids[0].name)
         self.assertEqual(original_partner, invoice.partner_id['name'])
@@ -257,3 +263,173 @@ class TestRecurringContract(BaseContractTest):
             original_price - contract3.total_amount,
             invoice.amount_total)
         self.assertEqual(original_start_date, invoice2.date_invoice)
+
+    def test_bulk_generation(self):
+        """
+            The bulk generation must produce the same invoices as the
+            generation made group by group. The invoice lines are built
+            while the contracts hold the same next invoice dates.
+        """
+        journal = self.env['account.journal'].search(
+            [('type', '=', 'sale'), ('company_id', '=', 1)], limit=1)
+        contract_class = type(self.env['recurring.contract'])
+        get_inv_lines_data = contract_class.get_inv_lines_data
+        next_month = fields.Date.to_string(
+            date.today() + relativedelta(months=1))
+        results = list()
+        for method in ('_generate_invoices_bulk',
+                       '_generate_invoices_per_group'):
+            group = self.create_group({
+                'partner_id': self.david.id,
+                'advance_billing_months': 2,
+            })
+            contract = self.create_contract(
+                {
+                    'partner_id': self.david.id,
+                    'group_id': group.id,
+                },
+                [{'amount': 40.0}]
+            )
+            contract2 = self.create_contract(
+                {
+                    'partner_id': self.david.id,
+                    'group_id': group.id,
+                    'next_invoice_date': next_month,
+                },
+                [{'amount': 20.0}]
+            )
+            contract.signal_workflow('contract_validated')
+            contract2.signal_workflow('contract_validated')
+            invoicer = self.env['recurring.invoicer'].create(
+                {'source': self._testMethodName})
+            lines_dates = list()
+
+            def _get_inv_lines_data(contracts):
+                lines_dates.append(
+                    sorted(contracts.mapped('next_invoice_date')))
+                return get_inv_lines_data(contracts)
+
+            with patch.object(contract_class, 'get_inv_lines_data',
+                              _get_inv_lines_data):
+                getattr(group, method)(journal, invoicer)
+            invoices = invoicer.invoice_ids.sorted('date_invoice')
+            results.append((
+                lines_dates,
+                invoices.mapped('date_invoice'),
+                invoices.mapped('amount_total'),
+                invoices.mapped('state'),
+                contract.next_invoice_date,
+                contract2.next_invoice_date,
+                group.next_invoice_date,
+            ))
+        self.assertEqual(len(results[0][1]), 3)
+        self.assertEqual(results[0], results[1])
+
+    def test_update_next_invoice_date(self):
+        """
+            Contracts sharing the same next invoice date are moved
+            according to the recurrence of their group.
+        """
+        monthly = self.create_group({'partner_id': self.thomas.id})
+        weekly = self.create_group({
+            'partner_id': self.thomas.id,
+            'recurring_unit': 'week',
+            'recurring_value': 2,
+        })
+        contracts = self.con_obj
+        for group in (monthly, monthly, weekly):
+            contracts += self.create_contract(
+                {
+                    'partner_id': self.thomas.id,
+                    'group_id': group.id,
+                    'next_invoice_date': '2017-01-31',
+                },
+                [{'amount': 10.0}]
+            )
+        contracts.update_next_invoice_date()
+        self.assertEqual(
+            contracts.mapped('next_invoice_date'),
+            ['2017-02-28', '2017-02-28', '2017-02-14'])
+
+    def test_bulk_termination(self):
+        """
+            Expired contracts are terminated at once when the bulk
+            termination is enabled.
+        """
+        self.env['ir.config_parameter'].set_param(
+            'recurring_contract.bulk_termination', 'True')
+        group = self.create_group({'partner_id': self.michel.id})
+        contracts = self.con_obj
+        for amount in (10.0, 20.0):
+            contracts += self.create_contract(
+                {
+                    'partner_id': self.michel.id,
+                    'group_id': group.id,
+                },
+                [{'amount': amount}]
+            )
+        contracts.signal_workflow('contract_validated')
+        contracts.write({'end_date': '2017-01-31'})
+        self.con_obj.with_context(async_mode=False).end_date_reached()
+        self.assertEqual(contracts.mapped('state'),
+                         ['terminated', 'terminated'])
+        self.assertEqual(contracts[0].end_date, contracts[1].end_date)
+
+    def test_coalesce_clean_jobs(self):
+        """
+            Cleaning again groups having a pending job merges them into
+            that job.
+        """
+        group = self.create_group(
+            {'partner_id': self.thomas.id}).with_context(async_mode=True)
+        group2 = self.create_group(
+            {'partner_id': self.thomas.id}).with_context(async_mode=True)
+        group.clean_invoices()
+        (group | group2).clean_invoices()
+        group2.clean_invoices()
+        jobs = self.env['queue.job'].search([
+            ('method_name', '=', '_clean_generate_invoices'),
+            ('state', '=', 'pending'),
+        ])
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(sorted(jobs.record_ids),
+                         sorted((group | group2).ids))
+
+    def test_streamed_pages(self):
+        """
+            Paging through the due groups follows the partner ids even when
+            the partner names are sorted the other way around.
+        """
+        partner_obj = self.env['res.partner']
+        zoe = partner_obj.create({'name': 'Zoe Streamed'})
+        adam = partner_obj.create({'name': 'Adam Streamed'})
+        groups = self.group_obj
+        for partner in (zoe, zoe, adam):
+            group = self.create_group({'partner_id': partner.id})
+            contract = self.create_contract(
+                {
+                    'partner_id': partner.id,
+                    'group_id': group.id,
+                },
+                [{'amount': 10.0}]
+            )
+            contract.signal_workflow('contract_validated')
+            groups += group
+        wizard = self.env['recurring.invoicer.wizard']
+        date_limit = date.today() + relativedelta(months=+1)
+        last_group = groups[0].search([
+            ('partner_id', '<', zoe.id)], order='id desc', limit=1)
+        last_partner_id = last_group.partner_id.id
+        seen = self.group_obj
+        while True:
+            page = wizard._get_streamed_page(
+                last_partner_id, last_group.id, date_limit, 1)
+            if not page:
+                break
+            seen += page
+            last_group = page[-1]
+            last_partner_id = last_group.partner_id.id
+        self.assertEqual(seen & groups, groups)
+        # The groups of a partner are read within the same page
+        self.assertEqual(len(seen.filtered(lambda g: g.partner_id == zoe)),
+                         2)
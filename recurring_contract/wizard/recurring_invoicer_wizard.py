@@ -13,6 +13,10 @@ from odoo import fields, models, api
 import datetime
 from dateutil.relativedelta import relativedelta
 
+import logging
+
+logger = logging.getLogger(__name__)
+
 
 class InvoicerWizard(models.TransientModel):
 
@@ -22,6 +26,24 @@ class InvoicerWizard(models.TransientModel):
     _name = 'recurring.invoicer.wizard'
 
     generation_date = fields.Date(readonly=True)
+    sharded = fields.Boolean(
+        'Parallel generation',
+        default=lambda self: self._default_sharded(),
+        help='Split the contract groups into shards generated in parallel '
+             'by the job workers.')
+    shard_size = fields.Integer(
+        default=lambda self: self._default_shard_size(),
+        help='Maximum number of contract groups in a shard.')
+
+    @api.model
+    def _default_sharded(self):
+        return self.env['ir.config_parameter'].sudo().get_param(
+            'recurring_contract.invoicer_sharded') == 'True'
+
+    @api.model
+    def _default_shard_size(self):
+        return int(self.env['ir.config_parameter'].sudo().get_param(
+            'recurring_contract.invoicer_shard_size', 500))
 
     @api.multi
     def generate(self):
@@ -33,9 +55,14 @@ class InvoicerWizard(models.TransientModel):
             ('next_invoice_date', '!=', False)])
 
         invoicer = recurring_invoicer_obj.create({'source': self._name})
-        # Add a job for all groups and start the job when all jobs are created.
-        for group in contract_groups:
-            group.generate_invoices(invoicer)
+        if self.sharded:
+            contract_groups.generate_invoices_sharded(
+                invoicer, self.shard_size)
+        else:
+            # Add a job for all groups and start the job when all jobs are
+            # created.
+            for group in contract_groups:
+                group.generate_invoices(invoicer)
 
         return {
             'name': 'recurring.invoicer.form',
@@ -46,7 +73,84 @@ class InvoicerWizard(models.TransientModel):
             'type': 'ir.actions.act_window',
         }
 
+    @api.multi
+    def generate_streamed(self, page_size=1000):
+        """ Pages through the due contract groups ordered by partner and id
+        and launches the generation of each page as soon as it is read.
+        A page is completed with the remaining groups of its last partner,
+        so that the groups of a partner are never split between pages (and
+        their shards). The last scheduled group is saved on the invoicer
+        after each page, so that an interrupted run resumes where it
+        stopped.
+        :param page_size: number of contract groups read at once
+        :return: recurring.invoicer record
+        """
+        date_limit = datetime.date.today() + relativedelta(months=+1)
+        invoicer_obj = self.env['recurring.invoicer']
+        invoicer = invoicer_obj.search([
+            ('source', '=', self._name), ('streaming', '=', True)],
+            order='id desc', limit=1)
+        if invoicer:
+            logger.info("Resuming invoice generation after group {0}".format(
+                invoicer.last_group_id))
+        else:
+            invoicer = invoicer_obj.create({
+                'source': self._name, 'streaming': True})
+        while True:
+            contract_groups = self._get_streamed_page(
+                invoicer.last_partner_id, invoicer.last_group_id,
+                date_limit, page_size)
+            if not contract_groups:
+                break
+            if self.sharded:
+                contract_groups.generate_invoices_sharded(
+                    invoicer, self.shard_size)
+            else:
+                for group in contract_groups:
+                    group.generate_invoices(invoicer)
+            invoicer.write({
+                'last_partner_id': contract_groups[-1].partner_id.id,
+                'last_group_id': contract_groups[-1].id,
+            })
+            # Save the checkpoint together with the created jobs and
+            # release the memory used by the page.
+            self.env.cr.commit()
+            self.env.invalidate_all()
+        invoicer.streaming = False
+        return invoicer
+
+    @api.model
+    def _get_streamed_page(self, last_partner_id, last_group_id, date_limit,
+                           page_size):
+        """ Reads the next page of due contract groups after the given
+        checkpoint. The keyset is compared on the raw partner_id column
+        (an ORM order on partner_id would sort by the partner name), then
+        the page is completed with the remaining groups of its last partner.
+        :return: recurring.contract.group recordset ordered by partner and id
+        """
+        self.env.cr.execute("""
+            SELECT id, partner_id FROM recurring_contract_group
+            WHERE (partner_id, id) > (%s, %s)
+            AND next_invoice_date <= %s
+            ORDER BY partner_id, id
+            LIMIT %s
+        """, (last_partner_id or 0, last_group_id or 0, date_limit,
+              page_size))
+        rows = self.env.cr.fetchall()
+        if not rows:
+            return self.env['recurring.contract.group']
+        last_id, last_partner = rows[-1]
+        self.env.cr.execute("""
+            SELECT id FROM recurring_contract_group
+            WHERE partner_id = %s AND id > %s
+            AND next_invoice_date <= %s
+            ORDER BY id
+        """, (last_partner, last_id, date_limit))
+        group_ids = [row[0] for row in rows]
+        group_ids += [row[0] for row in self.env.cr.fetchall()]
+        return self.env['recurring.contract.group'].browse(group_ids)
+
     @api.model
     def generate_from_cron(self):
-        self.generate()
+        self.create({}).generate_streamed()
         return True